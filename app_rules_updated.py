@@ -1,15 +1,17 @@
 import time
 import os
 import logging
-from concurrent.futures import ThreadPoolExecutor
 from difflib import SequenceMatcher
 import streamlit as st
 from streamlit_option_menu import option_menu
 
 from chatbot import BerryPieChatbot
-from groq_models_v2 import fca_checker_results, video_card_generation, reviewed_transcript
-from video_processing import transcribe_audio_with_whisper, extract_audio_from_video, video_media_processing
+from groq_models_v2 import video_card_generation, reviewed_transcript
+from workspace import create_workspace, evict_workspaces, save_upload, touch_workspace, workspace_of
+from job_queue import JobQueue, start_workers
 from pdf_parsing import process_pdf
+# The rules shown here are the ones the review jobs check
+from fca_rules_updated import fca_handbook_full_names, fca_handbook_list, rules_list
 
 
 
@@ -18,74 +20,6 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
-default_system_message = """
-You are a compliance officer. Your task is to review the following rule and verify whether the provided sales deck complies with it.
-Be flexible and not very strict when reviewing the sales deck. Tend to validate rules more than refuse.
-The rule should be considered violated only if the sales deck completely disregards it, in all other cases, accept and validate compliance.
-
-Provide your evaluation in JSON format with the following fields:
-- rule_name (str): The name or identifier of the rule being evaluated.
-- label (bool): Return true if the sales deck complies with the rule, otherwise return false.
-- part (list[str]): List of specific text parts from the sales deck that relate directly to the rule, and if the sales deck is missing text related to the rule violation, simply add: "no related content for this rule
-- suggestion (list[str]): A list of recommended changes or improvements for each text mentioned in part. If no changes are needed and the rule is fully respected, leave this field empty.
-
-Ensure the output is following this JSON schema:
-{
-  "rule_name": "",
-  "label": true OR false,
-  "part": [],
-  "suggestion": []
-}
-"""
-
-fca_handbook_full_names = [
-    "Financial Services and Markets Act (FSMA)",
-    "FCA Consumer Credit sourcebook (CONC)",
-    "FCA Principles for Businesses (PRIN)",
-    "FCA Conduct of Business Sourcebook (COBS)",
-    "Financial promotions on social media"
-] # used for user interface only
-
-fca_handbook_list = ["FSMA", "FCA CONC", "FCA PRIN", "FCA COBS", "Financial promotions on social media"]
-
-Clear_Fair_and_Not_Misleading = {
-    'rule_name': "Clear, Fair, and Not Misleading",
-    'handbooks': [fca_handbook_list[1], fca_handbook_list[2], fca_handbook_list[3], fca_handbook_list[4]],
-    'rule_text': "The video's content must be presented clearly, fairly, and in a way that doesn't mislead viewers. This applies to the overall message, the presentation of risks and benefits, and any claims or statements made."
-}
-
-Transparent_and_Fair_Terms_and_Comparisons = {
-    'rule_name': "Transparent and Fair Terms and Comparisons",
-    'handbooks': [fca_handbook_list[1], fca_handbook_list[3]],
-    'rule_text': "The video content must use terms like 'guaranteed,' 'protected,' or 'secure' only if they are fully backed by clear, accurate information, with any risks clearly highlighted. For products with complex fees or payments, provide enough detail to ensure viewers understand the costs. Comparisons with other products should be fair, balanced, and easy to understand."
-}
-
-Disclosure_of_Risks_for_Credit_and_BNPL_Offers = {
-    'rule_name': "Disclosure of Risks for Credit and BNPL Offers",
-    'handbooks': [fca_handbook_list[1], fca_handbook_list[3]],
-    'rule_text': "In case of video content promoting 'Buy Now, Pay Later' (BNPL) or credit offers, any risks must be clearly disclosed. This includes interest rates after promotions, conditions where interest may apply, and potential impacts on credit ratings. For debt solutions, explain any possible increase in the total payable amount, changes in repayment terms, or credit rating effects."
-}
-
-Risk_Warnings = {
-    'rule_name': "Risk Warnings",
-    'handbooks': [fca_handbook_list[1], fca_handbook_list[3], fca_handbook_list[4]],
-    'rule_text': "The video must include clear and prominent risk warnings, especially if it features high-cost short-term credit (HCSTC) products or high-risk investments (HRIs). These warnings should be easily visible and understandable, not hidden in captions or supplementary text."
-}
-
-Consumer_Understanding = {
-    'rule_name': "Consumer Understanding",
-    'handbooks': [fca_handbook_list[2], fca_handbook_list[4]],
-    'rule_text': "The video should be designed to be easily understood by its target audience. It should avoid using jargon or complex language, particularly when targeting retail clients. The information should be presented in a way that avoids confusion and empowers viewers to make informed decisions."
-}
-
-Avoidance_of_High_Pressure_Selling = {
-    'rule_name': "Avoidance of High-Pressure Selling",
-    'handbooks': [fca_handbook_list[1]],
-    'rule_text': "The video should not employ high-pressure tactics or create an undue sense of urgency. Viewers should be given adequate time to consider their options without feeling pressured or manipulated."
-}
-
-rules_list = [Clear_Fair_and_Not_Misleading, Transparent_and_Fair_Terms_and_Comparisons, Disclosure_of_Risks_for_Credit_and_BNPL_Offers, Risk_Warnings, Consumer_Understanding, Avoidance_of_High_Pressure_Selling]
-
 @st.cache_resource
 def get_book_rule_status_and_suggestion(handbook_name: str, transcript_review_output: dict):
     handbook_rules_names = []
@@ -93,6 +27,12 @@ def get_book_rule_status_and_suggestion(handbook_name: str, transcript_review_ou
         if handbook_name in rule['handbooks']:
             handbook_rules_names.append(rule["rule_name"])
     handbook_rules_status = {rule_name: "Respected" for rule_name in handbook_rules_names}
+    for skipped_rule in transcript_review_output.get('skipped_rules', []):
+        if skipped_rule['rule_name'] in handbook_rules_names:
+            handbook_rules_status[skipped_rule['rule_name']] = "Not applicable"
+    for rule_name in transcript_review_output.get('failed_rules', []):
+        if rule_name in handbook_rules_names:
+            handbook_rules_status[rule_name] = "Not checked"
     for suggestion in transcript_review_output['suggestions']:
         if suggestion['not_respected_rule'] in handbook_rules_names:
             handbook_rules_status[suggestion['not_respected_rule']] = {'responsible_parts':suggestion['responsible_parts'], 
@@ -100,6 +40,114 @@ def get_book_rule_status_and_suggestion(handbook_name: str, transcript_review_ou
     return handbook_rules_status
 
 
+class ReviewPipelineState:
+    """Tracks which review stages already ran for one uploaded video, so Streamlit reruns only run what is missing.
+
+    Stages: saved, transcribed, frames_processed, reviewed.
+    """
+
+    def __init__(self, fingerprint: str):
+        self.fingerprint = fingerprint
+        self.completed = set()
+        self.outputs = {}
+
+    def done(self, stage: str) -> bool:
+        return stage in self.completed
+
+    def run(self, stage: str, compute):
+        """Run `compute` once for the stage and return its stored output on every later call."""
+        if stage not in self.completed:
+            self.outputs[stage] = compute()
+            self.completed.add(stage)
+            logging.info(f"Pipeline stage '{stage}' completed for {self.fingerprint[:12]}")
+        return self.outputs[stage]
+
+
+def get_session_workspace() -> str:
+    """Return this session's private workspace directory, evicting stale workspaces when a new one is created."""
+    workspace = st.session_state.get('workspace')
+    if workspace is None or not os.path.isdir(workspace):
+        workspace = create_workspace()
+        st.session_state['workspace'] = workspace
+        # Workspaces of other sessions stay while a job still reads their files
+        job_workspaces = (workspace_of(payload['video_path']) for payload in get_job_queue().active_payloads()
+                          if 'video_path' in payload)
+        evict_workspaces(keep=(workspace, *filter(None, job_workspaces)))
+    touch_workspace(workspace)
+    return workspace
+
+
+def get_upload_id(uploaded_file) -> str:
+    """Identify an uploaded file across reruns without reading its content."""
+    return getattr(uploaded_file, "file_id", None) or f"{uploaded_file.name}:{uploaded_file.size}"
+
+
+def get_pipeline_state(fingerprint: str) -> ReviewPipelineState:
+    """Return the session's pipeline state, starting a fresh one when a different file is uploaded."""
+    pipeline = st.session_state.get('pipeline')
+    if pipeline is None or pipeline.fingerprint != fingerprint:
+        pipeline = ReviewPipelineState(fingerprint)
+        st.session_state['pipeline'] = pipeline
+    return pipeline
+
+
+# Stage names reported by review jobs, as shown to the user
+REVIEW_STAGE_LABELS = {
+    "queued": "waiting for a free worker",
+    "transcribing": "transcribing the audio and reading on-screen text",
+    "reviewing": "checking the FCA rules",
+    "processing_frames": "finishing reading on-screen text",
+}
+
+
+@st.cache_resource
+def get_job_queue() -> JobQueue:
+    """Start the review worker processes once per server and return the shared job queue."""
+    start_workers()
+    return JobQueue()
+
+
+def submit_review_job(pipeline: ReviewPipelineState, video_path: str, model_name: str):
+    """Queue the review of the pipeline's video; transcription, frame OCR and rule checks start right away."""
+    pipeline.outputs.pop('job_error', None)
+    pipeline.outputs['job_id'] = get_job_queue().submit(
+        "review_video", {'video_path': os.path.abspath(video_path), 'model_name': model_name}
+    )
+
+
+def wait_for_review_job(pipeline: ReviewPipelineState, ready=None) -> dict:
+    """Poll the pipeline's review job until `ready(job)` holds or it finishes, showing its stage.
+
+    Returns the job, or None if it failed. Once the job is done its results land in
+    the pipeline state. The job runs in a worker process, so navigating away does not
+    lose it: the next rerun finds the job ID in the pipeline state and resumes polling.
+    """
+    job_queue = get_job_queue()
+    status_spot = st.empty()
+    while True:
+        job = job_queue.get(pipeline.outputs['job_id'])
+        if job is None or job['status'] == "failed":
+            status_spot.error("The review failed, please try again.")
+            pipeline.outputs['job_error'] = job['error'] if job else "job not found"
+            logging.error(f"Review job failed: {pipeline.outputs['job_error']}")
+            del pipeline.outputs['job_id']
+            return None
+        if job['status'] == "done":
+            if not pipeline.done("transcribed"):
+                pipeline.run("transcribed", lambda: job['result']['transcript'])
+                st.session_state['sales_deck'] = pipeline.outputs["transcribed"]
+            pipeline.run("frames_processed", lambda: job['result']['video_review_output'])
+            pipeline.run("reviewed", lambda: job['result']['transcript_review_output'])
+            pipeline.outputs['review_duration'] = job['finished_at'] - job['created_at']
+            status_spot.empty()
+            return job
+        if ready is not None and ready(job):
+            status_spot.empty()
+            return job
+        status_spot.info(f"Reviewing in progress: {REVIEW_STAGE_LABELS.get(job['stage'], job['stage'])}...")
+        time.sleep(1)
+
+
 global transcript_text
 transcript_text = ""
 
@@ -115,37 +163,39 @@ def main_app():
     # File uploader for video files
     video_file = st.file_uploader("Upload a Video", type=["mp4", "mov", "avi", "mkv"])
 
+    # default model selected 'llama-3.2-90b-text-preview'
+    model_name = 'llama-3.3-70b-versatile'
+
+    workspace = get_session_workspace()
+    pipeline = None
     if video_file is not None:
-        # Create the directory if it doesn't exist
-        temp_video_dir = "temp_video"
-        os.makedirs(temp_video_dir, exist_ok=True)
-        # Save the uploaded video to the directory
-        temp_video_path = os.path.join(temp_video_dir, video_file.name)
-        with open(temp_video_path, "wb") as f:
-            f.write(video_file.read())
-        
-        if video_file is not None:
-            # Create the directory for the audio if it doesn't exist
-            temp_audio_dir = "temp_audio"
-            os.makedirs(temp_audio_dir, exist_ok=True)
-            # Define the path for the extracted audio file
-            temp_audio_path = os.path.join(temp_audio_dir, "extracted_audio.mp3")
-            # Extract audio from the video
-            audio_path = extract_audio_from_video(temp_video_path, temp_audio_path)
-        
-        st.success("Audio extracted successfully!")
+        # Identifies the upload across reruns; the content hash is computed while saving
+        pipeline = get_pipeline_state(get_upload_id(video_file))
+
+        def save_video():
+            # Stream the uploaded video to the session workspace in fixed-size chunks
+            return save_upload(video_file, os.path.join(workspace, "video"))
+
+        temp_video_path, video_digest = pipeline.run("saved", save_video)
+
+        # The whole review starts in the background as soon as the video is saved; a failed job is
+        # only resubmitted from the "Check Compliance" button
+        if 'job_id' not in pipeline.outputs and 'job_error' not in pipeline.outputs and not pipeline.done("reviewed"):
+            submit_review_job(pipeline, temp_video_path, model_name)
+
+        if not pipeline.done("transcribed") and 'job_id' in pipeline.outputs:
+            # The job publishes the transcript before its rule checks and frame OCR finish
+            job = wait_for_review_job(pipeline, ready=lambda job: 'transcript' in job['partial'])
+            if job is not None and 'transcript' in job['partial']:
+                pipeline.run("transcribed", lambda: job['partial']['transcript'])
+        sales_deck = pipeline.outputs.get("transcribed")
+        st.session_state['sales_deck'] = sales_deck
+        logging.info("Sales deck initialized in session state.")
 
         # Display the video
         st.video(video_file)
 
-        # Transcribe the audio using Whisper
-        st.write("Transcribing audio...")
-        sales_deck = transcribe_audio_with_whisper(audio_path)
         st.text_area("Video Transcript:", sales_deck, height=400)
-        # Initialization
-        if 'sales_deck' not in st.session_state:
-            st.session_state['sales_deck'] = sales_deck
-            logging.info("Sales deck initialized in session state.")
 
     st.subheader("📄 Prospectus or Fact Sheet PDF Upload")
 
@@ -156,34 +206,45 @@ def main_app():
         )
 
     if pdf_files:
-        temp_pdf_dir = "temp_pdf"
-        os.makedirs(temp_pdf_dir, exist_ok=True)
-
-        saved_paths = []
+        # Each upload is saved and hashed once, like the video's "saved" stage; reruns reuse the result
+        saved_pdfs = st.session_state.get('saved_pdfs', {})
+        current_pdfs = {}
         for pdf_file in pdf_files:
-            temp_pdf_path = os.path.join(temp_pdf_dir, f"{int(time.time())}_{pdf_file.name}")
-            with open(temp_pdf_path, "wb") as f:
-                f.write(pdf_file.getbuffer())  # Changed from read() to getbuffer()
-            saved_paths.append(temp_pdf_path)
-
-        # Add processing state check
-        if 'processing' not in st.session_state:
-            st.session_state.processing = True
-            doc_content = process_pdf(saved_paths)
+            upload_id = get_upload_id(pdf_file)
+            saved = saved_pdfs.get(upload_id)
+            if saved is None or not os.path.exists(saved[1]):
+                temp_pdf_path, pdf_digest = save_upload(pdf_file, os.path.join(workspace, "pdf"))
+                saved = (pdf_digest, temp_pdf_path)
+            current_pdfs[upload_id] = saved
+        st.session_state['saved_pdfs'] = current_pdfs
+        doc_files = list(current_pdfs.values())
+
+        # Reprocess only when the set of uploaded PDFs changed
+        if st.session_state.get('doc_files') != doc_files:
+            # Pages are parsed in parallel processes and reported as they finish;
+            # files parsed before (same content hash) come straight from the cache
+            parse_status = st.empty()
+            page_counts = {}
+
+            def show_page_parsed(path, page_number, page_count):
+                page_counts[path] = page_counts.get(path, 0) + 1
+                parse_status.info(f"Parsed {sum(page_counts.values())} page(s) from {len(page_counts)} file(s)...")
+
+            doc_content = process_pdf([path for _, path in doc_files], on_page=show_page_parsed)
+            parse_status.empty()
             
             # Only update content after processing completes
             st.session_state['doc_content'] = doc_content
-            st.session_state.processing = False
+            st.session_state['doc_files'] = doc_files
             logging.info(f"PDF processing completed. Content length: {len(doc_content) if doc_content else 0}")
             
         st.success("PDF processing done")
     else:
         st.session_state['doc_content'] = None
+        st.session_state['doc_files'] = []
+        st.session_state['saved_pdfs'] = {}
         st.info("No PDF files uploaded.")
 
-    # default model selected 'llama-3.2-90b-text-preview'
-    model_name = 'llama-3.3-70b-versatile'
-
     # New rules section (no user interference)
     st.divider()
     st.subheader('👮 AI FCA Officer: Compliance Handbooks List')
@@ -195,28 +256,29 @@ def main_app():
         for i, elm in enumerate(fca_handbook_full_names):
             st.write(f"**{elm}**")
 
-    system_message = default_system_message
     st.divider()
     st.subheader('🚦 Running Compliance Checker for Audio/Visual Analysis')
     st.write("Our AI-powered Compliance Checker will analyze your audio and visual content for regulatory compliance, offering corrections for any detected issues before publishing.")
     # Call the generate function
     generate_output = st.button('Check Compliance')
-    if generate_output:
-        start = time.time()
-        with st.spinner(text="Reviewing In progress..."):
-            with ThreadPoolExecutor() as executor:
-                # Submit both tasks to run in parallel
-                future_transcript = executor.submit(fca_checker_results, rules_list, system_message, model_name, sales_deck)
-                future_video = executor.submit(video_media_processing, temp_video_path)
-                
-                # Get results
-                transcript_review_output = future_transcript.result()
-                video_review_output = future_video.result()
-                output = {'transcript_review_output': transcript_review_output, 'video_review_output': video_review_output}
+    if generate_output and pipeline is None:
+        st.warning("Please upload a video first.")
+    elif generate_output:
+        # The review job was started at upload, so this mostly collects its results
+        pipeline.outputs['review_requested'] = True
+        if not pipeline.done("reviewed") and 'job_id' not in pipeline.outputs:
+            submit_review_job(pipeline, temp_video_path, model_name)
+
+    review_requested = pipeline is not None and pipeline.outputs.get('review_requested')
+    if review_requested and 'job_id' in pipeline.outputs and not pipeline.done("reviewed"):
+        wait_for_review_job(pipeline)
 
-        end = time.time()
+    if review_requested and pipeline.done("reviewed") and pipeline.done("frames_processed"):
+        transcript_review_output = pipeline.outputs["reviewed"]
+        video_review_output = pipeline.outputs["frames_processed"]
+        output = {'transcript_review_output': transcript_review_output, 'video_review_output': video_review_output}
 
-        st.write(f"Reviewing Duration: {end-start:.2f} seconds")
+        st.write(f"Reviewing Duration: {pipeline.outputs['review_duration']:.2f} seconds")
 
         st.subheader("Audio Media reviewing results")
         for handbook in fca_handbook_list:
@@ -224,7 +286,11 @@ def main_app():
                 with st.expander(f"{handbook} ❌", expanded=False):
                     handbook_rules_status = get_book_rule_status_and_suggestion(handbook, transcript_review_output)
                     for rule in handbook_rules_status.keys():
-                        if isinstance(handbook_rules_status[rule], str):
+                        if handbook_rules_status[rule] == "Not applicable":
+                            st.write(f"{rule} ➖ (not applicable)")
+                        elif handbook_rules_status[rule] == "Not checked":
+                            st.write(f"{rule} ⚠️ (could not be checked, please run the review again)")
+                        elif isinstance(handbook_rules_status[rule], str):
                             st.write(f"{rule} ✔️")
                         else:
                             st.write(f"{rule} ❌")
@@ -237,7 +303,19 @@ def main_app():
                 with st.expander(f"{handbook} ✔️", expanded=False):
                     handbook_rules_status = get_book_rule_status_and_suggestion(handbook, transcript_review_output)
                     for rule in handbook_rules_status.keys():
-                        st.write(f"{rule} ✔️")
+                        if handbook_rules_status[rule] == "Not applicable":
+                            st.write(f"{rule} ➖ (not applicable)")
+                        elif handbook_rules_status[rule] == "Not checked":
+                            st.write(f"{rule} ⚠️ (could not be checked, please run the review again)")
+                        else:
+                            st.write(f"{rule} ✔️")
+
+        skipped_rules = output['transcript_review_output'].get('skipped_rules', [])
+        if skipped_rules:
+            with st.expander(f"Rules skipped as not applicable ({len(skipped_rules)})", expanded=False):
+                for skipped_rule in skipped_rules:
+                    st.write(f"**{skipped_rule['rule_name']}**: {skipped_rule['reason']} "
+                             f"(confidence {skipped_rule['confidence']:.2f})")
 
         st.subheader("Video Media reviewing results")
         disclaimer_status = output['video_review_output']["disclaimer_is_exist"]
@@ -299,7 +377,10 @@ def main_app():
                 return result.strip()
 
             # Assuming transcript_text is generated from the reviewed_transcript function
-            transcript_text = reviewed_transcript(sales_deck, partes_and_suggestions_to_follow, model_name)
+            transcript_text = pipeline.run(
+                "reviewed_transcript",
+                lambda: reviewed_transcript(sales_deck, partes_and_suggestions_to_follow, model_name),
+            )
 
             # Highlight the modified words
             highlighted_transcript = get_word_differences(sales_deck, transcript_text)
@@ -330,9 +411,11 @@ def main_app():
     st.subheader('🏷️ Product Card Generation')
     st.write("Let our AI generates metadata for your video!")
     generate_model_card = st.button('Product card')
-    if generate_model_card:
+    if generate_model_card and pipeline is None:
+        st.warning("Please upload a video first.")
+    elif generate_model_card:
         with st.spinner(text="Generation In progress..."):
-            video_card = video_card_generation(sales_deck, model_name)
+            video_card = pipeline.run("video_card", lambda: video_card_generation(sales_deck, model_name))
         st.markdown(video_card)
 
 
@@ -357,10 +440,13 @@ def chatbot_page():
     if 'chatbot' not in st.session_state:
         st.session_state.chatbot = BerryPieChatbot(
             transcript,
-            doc_content
+            doc_content,
+            documents=st.session_state.get('doc_files', [])
         )
 
     chatbot = st.session_state.chatbot
+    # PDFs uploaded after the chat started are indexed incrementally
+    chatbot.add_documents(st.session_state.get('doc_files', []))
 
     st.title("Virtual Assistant")
 
@@ -371,15 +457,6 @@ def chatbot_page():
     if 'messages' not in st.session_state:
         st.session_state.messages = []
 
-    # Function to stream text
-    def stream_response(text, container, delay=0.1):
-        streamed_text = ""
-        message_spot = container.empty()
-        for word in text.split():
-            streamed_text += word + " "
-            message_spot.markdown(streamed_text)
-            time.sleep(delay)
-
     # Show chat history
     for message in st.session_state.messages:
         if message['role'] == 'user':
@@ -392,18 +469,20 @@ def chatbot_page():
         # Append user message to history
         st.session_state.messages.append({"role": "user", "content": prompt})
         
-        # Get the chatbot's response
-        response = chatbot.chat(prompt)
-        
-        # Append assistant's response to history
-        st.session_state.messages.append({"role": "assistant", "content": response})
-        
         # Redisplay the new user message
         chat_container.chat_message("user").write(prompt)
-        
-        # Stream the assistant's response
+
+        # Stream the assistant's response as the tokens arrive
         with chat_container.chat_message("assistant"):
-            stream_response(response, st.empty(), delay=0.02)  # Streaming assistant response
+            response = st.write_stream(chatbot.chat_stream(prompt))
+            request_tokens = chatbot.last_request_tokens
+            st.caption(
+                f"{request_tokens.get('prompt_tokens', request_tokens.get('prompt_tokens_estimated'))} prompt tokens, "
+                f"{request_tokens.get('completion_tokens', '?')} completion tokens"
+            )
+
+        # Append assistant's response to history
+        st.session_state.messages.append({"role": "assistant", "content": response})
 
 
 def main():
@@ -0,0 +1,112 @@
+"""Review a directory or manifest of videos and PDFs without the Streamlit app.
+
+Each asset goes through audio extraction, transcription, frame OCR, the disclaimer
+check and the FCA rule checks; one JSON line per asset is written to the report.
+
+Usage:
+    python batch_review.py archive/ --output report.jsonl [--workers 4]
+    python batch_review.py manifest.txt --output report.jsonl --frame-extractor hybrid
+
+A manifest is a text file with one path per line, or a JSONL file with a "path" field.
+The Groq API key is read from the GROQ_API_KEY environment variable. The local and
+hybrid frame extractors also need the tesseract binary (apt-get install tesseract-ocr).
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import groq_client
+import pdf_parsing
+from review_pipeline import DEFAULT_MODEL, PDF_EXTENSIONS, SCENE_PROBE_SECONDS, VIDEO_EXTENSIONS, review_asset
+from video_processing import get_frame_text_extractor
+
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def collect_assets(source: str) -> list[str]:
+    """Return the video and PDF paths under a directory, or listed in a manifest file."""
+    extensions = VIDEO_EXTENSIONS + PDF_EXTENSIONS
+    if os.path.isdir(source):
+        paths = []
+        for dirpath, _, filenames in os.walk(source):
+            paths.extend(os.path.join(dirpath, name) for name in filenames if name.lower().endswith(extensions))
+        return sorted(paths)
+
+    paths = []
+    base_dir = os.path.dirname(os.path.abspath(source))
+    with open(source, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            path = json.loads(line)["path"] if line.startswith("{") else line
+            paths.append(path if os.path.isabs(path) else os.path.join(base_dir, path))
+    return paths
+
+
+def _init_worker(workers: int):
+    # Each process has its own rate limiter, so give each one an equal share of the account limits
+    groq_client.share_rate_limits(workers)
+    # Assets are already reviewed in parallel processes, so each one parses its PDFs in-process
+    pdf_parsing.PDF_PARSE_WORKERS = 1
+
+
+def _json_default(value):
+    # Review outputs hold sets of rule and handbook names
+    return sorted(value) if isinstance(value, set) else str(value)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("source", help="Directory to scan, or manifest file listing the assets")
+    parser.add_argument("--output", default="review_report.jsonl", help="JSONL report to append to")
+    parser.add_argument("--workers", type=int, default=max(1, min(4, os.cpu_count() or 1)),
+                        help="Number of assets reviewed in parallel processes")
+    parser.add_argument("--model", default=DEFAULT_MODEL, help="Groq model used for the rule checks")
+    parser.add_argument("--frame-extractor", choices=("groq", "local", "hybrid"), default="groq",
+                        help="Engine used to read on-screen text from video frames")
+    parser.add_argument("--scene-probe-seconds", type=float, default=SCENE_PROBE_SECONDS,
+                        help="Step at which videos are probed for short-lived captions between frame samples, 0 to disable")
+    args = parser.parse_args()
+
+    # Build the frame extractor once up front, so a missing OCR dependency is reported here
+    # instead of failing every video inside the workers
+    try:
+        get_frame_text_extractor(args.frame_extractor)
+    except (ImportError, RuntimeError) as e:
+        print(f"Cannot use the {args.frame_extractor} frame extractor: {e}")
+        return 1
+
+    paths = collect_assets(args.source)
+    if not paths:
+        print(f"No videos or PDFs found in {args.source}")
+        return 1
+    print(f"Reviewing {len(paths)} asset(s) with {args.workers} worker process(es)")
+
+    failed = 0
+    with open(args.output, "a", encoding="utf-8") as report, \
+            ProcessPoolExecutor(max_workers=args.workers, initializer=_init_worker, initargs=(args.workers,)) as pool:
+        futures = {
+            pool.submit(review_asset, path, args.model, args.frame_extractor,
+                        scene_probe_seconds=args.scene_probe_seconds): path
+            for path in paths
+        }
+        for done, future in enumerate(as_completed(futures), start=1):
+            record = future.result()
+            failed += record['status'] != "ok"
+            report.write(json.dumps(record, default=_json_default) + "\n")
+            report.flush()
+            print(f"[{done}/{len(paths)}] {record['status']:>5} {record['seconds']:7.1f}s {record['path']}")
+
+    print(f"Done: {len(paths) - failed} reviewed, {failed} failed, report written to {args.output}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,61 @@
+"""Compare per-rule fan-out, batched and cascaded rule evaluation on a transcript.
+
+Usage:
+    python benchmark_rule_modes.py transcript.txt [--runs 3] [--model llama-3.3-70b-versatile]
+                                   [--small-model llama-3.1-8b-instant]
+"""
+import argparse
+import time
+
+from fca_rules_updated import default_system_message, rules_list
+from groq_models_v2 import fca_checker_results, token_usage
+from llm_cache import llm_cache
+
+
+def run_mode(sales_deck: str, model_name: str, **options) -> dict:
+    """Run one uncached review with the given fca_checker_results options and return its wall time and token usage."""
+    llm_cache.clear()
+    token_usage.reset()
+    start = time.time()
+    output = fca_checker_results(rules_list, default_system_message, model_name, sales_deck, **options)
+    stats = token_usage.snapshot()
+    stats['seconds'] = time.time() - start
+    stats['not_respected_rules'] = sorted(output['not_respected_rules'])
+    stats['cascade_stats'] = output.get('cascade_stats')
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("transcript", help="Path to a text file holding the transcript to review")
+    parser.add_argument("--runs", type=int, default=3, help="Number of runs per mode")
+    parser.add_argument("--model", default="llama-3.3-70b-versatile", help="Groq model name")
+    parser.add_argument("--small-model", default="llama-3.1-8b-instant", help="First-tier model of the cascade mode")
+    args = parser.parse_args()
+
+    with open(args.transcript, encoding="utf-8") as f:
+        sales_deck = f.read()
+
+    print(f"Transcript: {len(sales_deck.split())} words, {len(rules_list)} rules, {args.runs} run(s) per mode")
+    modes = (
+        ("fan-out", {}),
+        ("batched", {'batched': True}),
+        ("cascade", {'cascade_model': args.small_model}),
+    )
+    for mode, options in modes:
+        runs = [run_mode(sales_deck, args.model, **options) for _ in range(args.runs)]
+
+        def mean(key):
+            return sum(run[key] for run in runs) / len(runs)
+
+        print(
+            f"{mode:>8}: {mean('seconds'):6.2f} s, {mean('requests'):4.1f} requests, "
+            f"{mean('prompt_tokens'):8.0f} prompt + {mean('completion_tokens'):6.0f} completion tokens"
+        )
+        print(f"{'':>8}  violated rules (last run): {runs[-1]['not_respected_rules']}")
+        if runs[-1]['cascade_stats']:
+            print(f"{'':>8}  cascade (last run): {runs[-1]['cascade_stats']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,28 +1,66 @@
 import json
 import os
-from groq import Groq
 import logging
 
+from conversation_memory import MEMORY_TOKEN_BUDGET, ConversationMemory, count_message_tokens
+from groq_client import create_chat_completion
+from pdf_parsing import build_vectordb, rag_tool
+from vector_store import DocumentRetriever
+
 
 #set logger
 logging.basicConfig(level=logging.INFO)
 
-# Initialize the Groq client (no need to manually pass API key if set in env variable GROQ_API_KEY)
-client = Groq()
-
 MODEL_NAME = "llama-3.3-70b-versatile"
 
 
 class BerryPieChatbot:
 
-    def __init__(self, transcript: str, doc_content: str):
+    def __init__(self, transcript: str, doc_content: str, token_budget: int = MEMORY_TOKEN_BUDGET,
+                 documents: list = None):
         self.transcript = transcript.strip() if transcript else ""
         self.doc_content = doc_content.strip() if doc_content else ""
-        self.history = []
+        self.token_budget = token_budget
+        # The documents are searched per question instead of being pasted into the system prompt.
+        # With (sha256, path) pairs the persistent per-PDF indexes are used, otherwise the text is indexed in memory.
+        if documents is not None:
+            self.vectordb = DocumentRetriever()
+            self.vectordb.add_documents(documents)
+        else:
+            self.vectordb = build_vectordb(self.doc_content)
         self._initialize_system_message()
 
+    def add_documents(self, documents: list):
+        """Make newly uploaded PDFs searchable; only PDFs never indexed before are embedded."""
+        if isinstance(self.vectordb, DocumentRetriever):
+            indexed = len(self.vectordb.digests)
+            self.vectordb.add_documents(documents)
+            if len(self.vectordb.digests) != indexed:
+                # The system prompt tells the model whether document excerpts will come
+                self.memory.system_message = {"role": "system", "content": self._build_system_prompt()}
+
+    def _has_documents(self) -> bool:
+        if isinstance(self.vectordb, DocumentRetriever):
+            return bool(self.vectordb.digests)
+        return bool(self.doc_content)
+
+    @property
+    def history(self) -> list:
+        """The conversation as it is sent to the model: system prompt, summary of older turns and recent turns."""
+        return self.memory.history
+
+    @property
+    def last_request_tokens(self) -> dict:
+        """Token counts of the latest request, estimated before sending and as reported by the API."""
+        return self.memory.last_request
+
     def _initialize_system_message(self):
         """Initialize the system message with transcript and document context."""
+        # Start the memory with the system prompt, which is always sent verbatim
+        self.memory = ConversationMemory(self._build_system_prompt(), token_budget=self.token_budget)
+
+    def _build_system_prompt(self) -> str:
+        """Return the system prompt for the transcript and the documents available so far."""
         base_prompt = """
             ROLE: Financial assistant for BerryPie (investment products expert)
             TONE: Professional yet approachable (clear, precise, compliant)
@@ -49,15 +87,12 @@ class BerryPieChatbot:
         doc_section = f"""
             ADDITIONAL CONTEXT:
             You also have access to financial documents (prospectuses and fact sheets).
-            If the transcript doesn't contain the answer but these documents do, use them to respond.
-            Document content:
-            \"\"\"
-            {self.doc_content[:5000]}
-            \"\"\"
-            If the document content is unavailable or irrelevant, say: "I don't have sufficient documentation to answer that."
-            """.strip() if self.doc_content else ""
+            The excerpts most relevant to each question are provided just before it.
+            If the transcript doesn't contain the answer but these excerpts do, use them to respond.
+            If the excerpts are unavailable or irrelevant, say: "I don't have sufficient documentation to answer that."
+            """.strip() if self._has_documents() else ""
 
-        if not self.transcript and not self.doc_content:
+        if not self.transcript and not doc_section:
             system_prompt = """
                 You're BerryPie's financial assistant, but no product information is currently available.
                 Respond professionally: "I don't have any active financial product details to reference at this time.
@@ -73,29 +108,82 @@ class BerryPieChatbot:
         logging.info("-----------------------------------------------------")
         logging.info(f"doc_section: {doc_section}")
 
-        # Append the system prompt to the history
         # Clean up whitespace and newlines
         system_prompt = "\n".join(line.strip() for line in system_prompt.split("\n"))
-        self.history.append({"role": "system", "content": system_prompt.strip()})
-
-    def chat(self, user_input: str) -> str:
-        self.history.append({"role": "user", "content": user_input})
-
-        # Make the initial API call to Groq
-        response = client.chat.completions.create(
+        return system_prompt.strip()
+
+    def _retrieve_context(self, user_input: str) -> list:
+        """Return a system message with the document chunks most relevant to the question, if any."""
+        if self.vectordb is None:
+            return []
+        try:
+            chunks = rag_tool(user_input, self.vectordb)
+        except Exception as e:
+            logging.error(f"Document retrieval failed: {e}")
+            return []
+        if not chunks:
+            return []
+        excerpts = "\n\n".join(f"[{i + 1}] {chunk.page_content}" for i, chunk in enumerate(chunks))
+        return [{"role": "system", "content": f"Document excerpts relevant to the next question:\n{excerpts}"}]
+
+    def _completion_kwargs(self, user_input: str) -> dict:
+        messages = self.memory.messages()
+        context = self._retrieve_context(user_input)
+        if context:
+            # Retrieved chunks go right before the question and are not kept in the memory
+            messages = messages[:-1] + context + messages[-1:]
+            self.memory.last_request['context_tokens'] = count_message_tokens(context)
+        return dict(
             model=MODEL_NAME,
-            messages=self.history,
+            messages=messages,
             temperature=0.2,
             max_tokens=1024,
             top_p=1,
+        )
+
+    def chat(self, user_input: str) -> str:
+        self.memory.add("user", user_input)
+
+        # Make the initial API call to Groq
+        response = create_chat_completion(
+            **self._completion_kwargs(user_input),
             stream=False  # Not streaming inside the function, returning full reply at once
         )
 
         response_message = response.choices[0].message.content
-        self.history.append({"role": "assistant", "content": response_message})
+        self.memory.record_usage(response.usage)
+        self.memory.add("assistant", response_message)
+        logging.info(f"Chat request tokens: {self.memory.last_request}")
 
         return response_message
 
+    def chat_stream(self, user_input: str):
+        """Yield the reply token by token as Groq streams it; the reply is added to the history at the end.
+
+        If the stream fails or the caller stops reading, the partial reply is kept, or
+        the user turn is dropped when nothing was received, so the turns stay paired.
+        """
+        self.memory.add("user", user_input)
+
+        parts = []
+        try:
+            stream = create_chat_completion(**self._completion_kwargs(user_input), stream=True)
+            for chunk in stream:
+                token = chunk.choices[0].delta.content if chunk.choices else None
+                if token:
+                    parts.append(token)
+                    yield token
+                # Groq reports the usage of a streamed request on its last chunk
+                usage = getattr(getattr(chunk, "x_groq", None), "usage", None)
+                if usage is not None:
+                    self.memory.record_usage(usage)
+        finally:
+            if parts:
+                self.memory.add("assistant", "".join(parts))
+            elif self.memory.turns and self.memory.turns[-1] == {"role": "user", "content": user_input}:
+                self.memory.turns.pop()
+            logging.info(f"Chat request tokens: {self.memory.last_request}")
+
 
 
 
@@ -0,0 +1,129 @@
+import logging
+import os
+
+from groq_client import create_chat_completion
+
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+SUMMARY_MODEL = "llama-3.1-8b-instant"
+# Tokens allowed for the messages of one chat request (system prompt, summary and recent turns)
+MEMORY_TOKEN_BUDGET = int(os.getenv("BERRYPIE_CHAT_TOKEN_BUDGET", 8000))
+# Messages always sent verbatim, i.e. at least the last user/assistant exchanges
+MEMORY_RECENT_MESSAGES = 4
+SUMMARY_MAX_TOKENS = 400
+
+SUMMARY_SYSTEM_MESSAGE = (
+    "You maintain the memory of a conversation between a client and a financial assistant. "
+    "Update the running summary with the new exchanges. Keep the client's questions, stated "
+    "circumstances and preferences, and the facts and figures the assistant gave. "
+    "Be concise and write plain prose, at most 200 words."
+)
+
+
+def count_tokens(text: str) -> int:
+    """Roughly count the tokens of a text, at four characters per token."""
+    return len(text or "") // 4 + 1
+
+
+def count_message_tokens(messages: list) -> int:
+    """Roughly count the prompt tokens of chat messages, including a small per-message overhead."""
+    return sum(count_tokens(message["content"]) + 4 for message in messages)
+
+
+class ConversationMemory:
+    """Token-budgeted chat history: the system prompt and recent turns are kept verbatim,
+    older turns are rolled into a running summary.
+
+    `messages()` returns what to send for the next request. Once it would exceed
+    `token_budget`, the oldest turns are summarised with `summary_model` until the
+    turns fill at most half of what the budget leaves after the system prompt, keeping
+    at least `recent_messages`. Compacting below the budget means a summary call only
+    happens every few turns. `last_request` holds the token counts of the latest request.
+    """
+
+    def __init__(self, system_prompt: str, token_budget: int = MEMORY_TOKEN_BUDGET,
+                 recent_messages: int = MEMORY_RECENT_MESSAGES, summary_model: str = SUMMARY_MODEL):
+        self.system_message = {"role": "system", "content": system_prompt}
+        self.token_budget = token_budget
+        self.recent_messages = recent_messages
+        self.summary_model = summary_model
+        self.summary = ""
+        self.turns = []
+        self.summarised_turns = 0
+        self.last_request = {}
+
+    def add(self, role: str, content: str):
+        self.turns.append({"role": role, "content": content})
+
+    def _summary_message(self) -> list:
+        if not self.summary:
+            return []
+        return [{"role": "system", "content": f"Summary of the earlier conversation:\n{self.summary}"}]
+
+    @property
+    def history(self) -> list:
+        """The messages as they stand, without summarising anything."""
+        return [self.system_message] + self._summary_message() + self.turns
+
+    def messages(self) -> list:
+        """Return the messages of the next request, summarising old turns first if the budget is exceeded."""
+        messages = self.history
+        prompt_tokens = count_message_tokens(messages)
+        if prompt_tokens > self.token_budget and len(self.turns) > self.recent_messages:
+            keep = self._turns_to_keep()
+            self._summarise(self.turns[:-keep])
+            self.turns = self.turns[-keep:]
+            messages = self.history
+            prompt_tokens = count_message_tokens(messages)
+            if prompt_tokens > self.token_budget:
+                logger.warning(f"Chat request uses {prompt_tokens} tokens, over the {self.token_budget} token budget")
+
+        self.last_request = {
+            'prompt_tokens_estimated': prompt_tokens,
+            'system_tokens': count_message_tokens([self.system_message]),
+            'summary_tokens': count_tokens(self.summary) if self.summary else 0,
+            'recent_messages': len(self.turns),
+            'summarised_messages': self.summarised_turns,
+        }
+        return messages
+
+    def _turns_to_keep(self) -> int:
+        turns_budget = (self.token_budget - count_message_tokens([self.system_message]) - SUMMARY_MAX_TOKENS) // 2
+        keep, tokens = 0, 0
+        for turn in reversed(self.turns):
+            tokens += count_message_tokens([turn])
+            if tokens > turns_budget:
+                break
+            keep += 1
+        return min(max(keep, self.recent_messages), len(self.turns) - 1)
+
+    def _summarise(self, old_turns: list):
+        exchanges = "\n".join(f"{turn['role'].upper()}: {turn['content']}" for turn in old_turns)
+        prompt = f"Current summary:\n{self.summary or '(empty)'}\n\nNew exchanges:\n{exchanges}"
+        try:
+            response = create_chat_completion(
+                model=self.summary_model,
+                messages=[
+                    {"role": "system", "content": SUMMARY_SYSTEM_MESSAGE},
+                    {"role": "user", "content": prompt},
+                ],
+                temperature=0,
+                max_tokens=SUMMARY_MAX_TOKENS,
+            )
+            self.summary = response.choices[0].message.content.strip()
+        except Exception as e:
+            # Keep the conversation going without the old turns rather than failing the user's request
+            logger.error(f"Summarising the conversation failed: {e}")
+        self.summarised_turns += len(old_turns)
+        logger.info(f"Rolled {len(old_turns)} message(s) into the conversation summary")
+
+    def record_usage(self, usage):
+        """Store the token usage reported by the API for the latest request."""
+        if usage is None:
+            return
+        self.last_request['prompt_tokens'] = usage.prompt_tokens
+        self.last_request['completion_tokens'] = usage.completion_tokens
+        self.last_request['total_tokens'] = usage.total_tokens
@@ -0,0 +1,306 @@
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+import weakref
+from functools import lru_cache
+
+import groq
+import httpx
+from dotenv import load_dotenv
+from groq import AsyncGroq, Groq
+from tenacity import AsyncRetrying, Retrying, retry_if_exception_type, stop_after_attempt, wait_random_exponential
+from tenacity.wait import wait_base
+
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# Sized to the widest fan-out of a review: rule checks, frame workers and transcription chunks
+GROQ_MAX_CONNECTIONS = int(os.getenv("GROQ_MAX_CONNECTIONS", 32))
+GROQ_KEEPALIVE_SECONDS = float(os.getenv("GROQ_KEEPALIVE_SECONDS", 60))
+GROQ_TIMEOUT = httpx.Timeout(120.0, connect=10.0)
+GROQ_MAX_ATTEMPTS = int(os.getenv("GROQ_MAX_ATTEMPTS", 6))
+
+
+
+def parse_rate_limits(spec: str) -> dict:
+    """Parse "model=rpm:tpm,model=rpm:tpm" into {model: (rpm, tpm)}; an empty or 0 tpm means no token limit."""
+    limits = {}
+    for item in filter(None, (part.strip() for part in (spec or "").split(","))):
+        model, _, values = item.partition("=")
+        requests_per_minute, _, tokens_per_minute = values.partition(":")
+        limits[model.strip()] = (int(requests_per_minute), int(tokens_per_minute or 0) or None)
+    return limits
+
+
+# Per-model (requests per minute, tokens per minute), defaulting to Groq's free tier. Set the account's
+# real limits with GROQ_RATE_LIMITS, e.g. "llama-3.3-70b-versatile=1000:300000,llama-3.1-8b-instant=1000:250000".
+# Models not listed use the default. Limits only pace calls up front; a 429 is still honoured via retry-after.
+MODEL_RATE_LIMITS = {
+    "llama-3.3-70b-versatile": (30, 6000),
+    "llama-3.1-8b-instant": (30, 6000),
+    "llama-3.2-90b-vision-preview": (15, 7000),
+    "whisper-large-v3-turbo": (20, None),
+    **parse_rate_limits(os.getenv("GROQ_RATE_LIMITS")),
+}
+DEFAULT_RATE_LIMIT = (
+    int(os.getenv("GROQ_REQUESTS_PER_MINUTE", 30)),
+    int(os.getenv("GROQ_TOKENS_PER_MINUTE", 6000)) or None,
+)
+# Completion tokens reserved per call; the reservation is settled against the reported usage afterwards
+EXPECTED_COMPLETION_TOKENS = int(os.getenv("GROQ_EXPECTED_COMPLETION_TOKENS", 300))
+
+# Errors worth retrying: rate limits, timeouts, dropped connections and 5xx responses
+RETRYABLE_ERRORS = (groq.RateLimitError, groq.APIConnectionError, groq.InternalServerError)
+
+
+def get_api_key() -> str:
+    """Read the Groq API key from the environment, falling back to Streamlit secrets."""
+    api_key = os.getenv("GROQ_API_KEY")
+    if api_key:
+        return api_key
+    import streamlit as st
+    return st.secrets["GROQ_API_KEY"]
+
+
+def _pool_limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=GROQ_MAX_CONNECTIONS,
+        max_keepalive_connections=GROQ_MAX_CONNECTIONS,
+        keepalive_expiry=GROQ_KEEPALIVE_SECONDS,
+    )
+
+
+@lru_cache(maxsize=None)
+def get_client() -> Groq:
+    """Return the process-wide Groq client, which keeps its connections alive between calls."""
+    logger.info(f"Creating shared Groq client with {GROQ_MAX_CONNECTIONS} pooled connections")
+    http_client = httpx.Client(limits=_pool_limits(), timeout=GROQ_TIMEOUT)
+    # Retries are handled by the shared rate limiter below, not by the SDK
+    return Groq(api_key=get_api_key(), http_client=http_client, max_retries=0)
+
+
+# Async connections belong to the event loop that opened them, so there is one client per loop
+_async_clients = weakref.WeakKeyDictionary()
+_async_clients_lock = threading.Lock()
+
+
+def get_async_client() -> AsyncGroq:
+    """Return the AsyncGroq client for the running event loop, sharing the same pool settings."""
+    loop = asyncio.get_running_loop()
+    with _async_clients_lock:
+        client = _async_clients.get(loop)
+        if client is None:
+            http_client = httpx.AsyncClient(limits=_pool_limits(), timeout=GROQ_TIMEOUT)
+            client = AsyncGroq(api_key=get_api_key(), http_client=http_client, max_retries=0)
+            _async_clients[loop] = client
+    return client
+
+
+class TokenBucket:
+    """Token bucket that hands out reservations; callers sleep for the returned delay outside the lock."""
+
+    def __init__(self, capacity: float, per_minute: float):
+        self.capacity = capacity
+        self.rate = per_minute / 60.0
+        self.available = capacity
+        self.updated = time.monotonic()
+
+    def reserve(self, amount: float) -> float:
+        """Take `amount` from the bucket and return how long to wait before it is actually available."""
+        now = time.monotonic()
+        self.available = min(self.capacity, self.available + (now - self.updated) * self.rate)
+        self.updated = now
+        # Never ask for more than the bucket holds, or the caller would wait forever
+        self.available -= min(amount, self.capacity)
+        return max(0.0, -self.available / self.rate)
+
+    def refund(self, amount: float):
+        """Give back `amount`; a negative amount charges the bucket for usage beyond the reservation."""
+        self.available = min(self.capacity, self.available + amount)
+
+
+class RateLimiter:
+    """Process-wide requests/min and tokens/min limiter shared by every Groq call, per model."""
+
+    def __init__(self, limits: dict = MODEL_RATE_LIMITS, default: tuple = DEFAULT_RATE_LIMIT):
+        self.limits = limits
+        self.default = default
+        self._lock = threading.Lock()
+        self._buckets = {}
+        self._paused_until = {}
+
+    def _model_buckets(self, model: str):
+        if model not in self._buckets:
+            requests_per_minute, tokens_per_minute = self.limits.get(model, self.default)
+            self._buckets[model] = (
+                TokenBucket(requests_per_minute, requests_per_minute),
+                TokenBucket(tokens_per_minute, tokens_per_minute) if tokens_per_minute else None,
+            )
+        return self._buckets[model]
+
+    def reserve(self, model: str, tokens: int = 0) -> float:
+        """Reserve one request and `tokens` tokens for the model and return the delay to honour."""
+        with self._lock:
+            requests_bucket, tokens_bucket = self._model_buckets(model)
+            delay = requests_bucket.reserve(1)
+            if tokens_bucket and tokens:
+                delay = max(delay, tokens_bucket.reserve(tokens))
+            paused_for = self._paused_until.get(model, 0.0) - time.monotonic()
+        return max(delay, paused_for)
+
+    def acquire(self, model: str, tokens: int = 0):
+        delay = self.reserve(model, tokens)
+        if delay > 0:
+            logger.info(f"Rate limiter delaying {model} call by {delay:.2f} seconds")
+            time.sleep(delay)
+
+    async def acquire_async(self, model: str, tokens: int = 0):
+        delay = self.reserve(model, tokens)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def record_usage(self, model: str, estimated_tokens: int, actual_tokens: int):
+        """Settle a reservation: give back unused tokens, or charge the tokens used beyond it."""
+        if not actual_tokens:
+            return
+        with self._lock:
+            _, tokens_bucket = self._model_buckets(model)
+            if tokens_bucket:
+                tokens_bucket.refund(estimated_tokens - actual_tokens)
+
+    def pause(self, model: str, seconds: float):
+        """Hold every call to the model for `seconds`, after the API answered 429."""
+        with self._lock:
+            self._paused_until[model] = max(self._paused_until.get(model, 0.0), time.monotonic() + seconds)
+
+
+rate_limiter = RateLimiter()
+
+
+def share_rate_limits(processes: int):
+    """Give this process 1/`processes` of every limit, for processes that call Groq with the same account.
+
+    Each process has its own limiter, so without this N processes would send up to N times the account limits.
+    """
+    global rate_limiter
+
+    def share(limit):
+        return max(1, limit // processes) if limit else limit
+
+    limits = {model: (share(rpm), share(tpm)) for model, (rpm, tpm) in MODEL_RATE_LIMITS.items()}
+    rpm, tpm = DEFAULT_RATE_LIMIT
+    rate_limiter = RateLimiter(limits, (share(rpm), share(tpm)))
+    logger.info(f"Rate limits shared across {processes} process(es)")
+
+
+def _retry_after_seconds(exception):
+    """Return the retry-after delay sent with an API error, if any."""
+    response = getattr(exception, "response", None)
+    if response is None:
+        return None
+    try:
+        return float(response.headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class wait_retry_after(wait_base):
+    """Wait for the server's retry-after delay plus jitter, or fall back to jittered exponential backoff."""
+
+    def __init__(self, fallback):
+        self.fallback = fallback
+
+    def __call__(self, retry_state):
+        retry_after = _retry_after_seconds(retry_state.outcome.exception())
+        if retry_after is not None:
+            return retry_after + random.uniform(0, 1)
+        return self.fallback(retry_state)
+
+
+def _retry_policy(model: str) -> dict:
+    def before_sleep(retry_state):
+        exception = retry_state.outcome.exception()
+        if isinstance(exception, groq.RateLimitError):
+            rate_limiter.pause(model, _retry_after_seconds(exception) or 1.0)
+        logger.warning(f"Groq call to {model} failed ({exception}), retry {retry_state.attempt_number}/{GROQ_MAX_ATTEMPTS - 1}")
+
+    return dict(
+        retry=retry_if_exception_type(RETRYABLE_ERRORS),
+        wait=wait_retry_after(wait_random_exponential(multiplier=1, max=30)),
+        stop=stop_after_attempt(GROQ_MAX_ATTEMPTS),
+        before_sleep=before_sleep,
+        reraise=True,
+    )
+
+
+def estimate_tokens(messages: list, max_tokens: int = None) -> int:
+    """Roughly estimate the tokens of a chat request, counting four characters per token.
+
+    The completion is counted at its expected size, not at `max_tokens`, so calls
+    are not held back for tokens they will almost never use.
+    """
+    characters = 0
+    for message in messages:
+        content = message.get("content") or ""
+        if isinstance(content, list):
+            content = " ".join(part.get("text", "") for part in content if isinstance(part, dict))
+        characters += len(content)
+    return characters // 4 + min(max_tokens or EXPECTED_COMPLETION_TOKENS, EXPECTED_COMPLETION_TOKENS)
+
+
+def _total_tokens(response) -> int:
+    usage = getattr(response, "usage", None)
+    return getattr(usage, "total_tokens", 0) or 0
+
+
+def create_chat_completion(**kwargs):
+    """Create a chat completion through the shared rate limiter, retrying rate limits and transient errors."""
+    model = kwargs["model"]
+    estimated = estimate_tokens(kwargs["messages"], kwargs.get("max_tokens"))
+    for attempt in Retrying(**_retry_policy(model)):
+        with attempt:
+            rate_limiter.acquire(model, estimated)
+            response = get_client().chat.completions.create(**kwargs)
+    if not kwargs.get("stream"):
+        rate_limiter.record_usage(model, estimated, _total_tokens(response))
+    return response
+
+
+async def acreate_chat_completion(**kwargs):
+    """Async counterpart of `create_chat_completion`, using the AsyncGroq client."""
+    model = kwargs["model"]
+    estimated = estimate_tokens(kwargs["messages"], kwargs.get("max_tokens"))
+    async for attempt in AsyncRetrying(**_retry_policy(model)):
+        with attempt:
+            await rate_limiter.acquire_async(model, estimated)
+            response = await get_async_client().chat.completions.create(**kwargs)
+    if not kwargs.get("stream"):
+        rate_limiter.record_usage(model, estimated, _total_tokens(response))
+    return response
+
+
+def create_transcription(**kwargs):
+    """Create an audio transcription through the shared rate limiter, retrying rate limits and transient errors."""
+    model = kwargs["model"]
+    for attempt in Retrying(**_retry_policy(model)):
+        with attempt:
+            rate_limiter.acquire(model)
+            response = get_client().audio.transcriptions.create(**kwargs)
+    return response
+
+
+def _reset_after_fork():
+    # Pooled sockets must not be shared with a forked worker process
+    get_client.cache_clear()
+    _async_clients.clear()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
@@ -1,31 +1,65 @@
 import os
-from dotenv import load_dotenv
-from groq import Groq
 import typing_extensions as typing
 import logging
 import json
 import concurrent.futures
+import random
+import threading
 import time
-import streamlit as st
 
-
-GROQ_API_KEY = st.secrets["GROQ_API_KEY"]
-
-# load_dotenv()
-# GROQ_API_KEY = os.getenv('GROQ_API_KEY')
+from llm_cache import cached_chat_completion
+from rule_prefilter import MIN_SKIP_CONFIDENCE, prefilter_rules
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
+class TokenUsage:
+    """Thread-safe running totals of the tokens reported by the API, used for benchmarking."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.requests = 0
+            self.prompt_tokens = 0
+            self.completion_tokens = 0
+
+    def add(self, usage):
+        if usage is None:
+            return
+        with self._lock:
+            self.requests += 1
+            self.prompt_tokens += usage.prompt_tokens or 0
+            self.completion_tokens += usage.completion_tokens or 0
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                'requests': self.requests,
+                'prompt_tokens': self.prompt_tokens,
+                'completion_tokens': self.completion_tokens,
+                'total_tokens': self.prompt_tokens + self.completion_tokens,
+            }
+
+
+token_usage = TokenUsage()
+
+
 # Text Processing functions
 
-def groq_model_generation(prompt: str, system_message: str, model: str) -> dict:
-    """Model names: llama3_1, mixtral, gemma"""
+def groq_model_generation(prompt: str, system_message: str, model: str, validate=None) -> dict:
+    """Model names: llama3_1, mixtral, gemma
+
+    With `validate`, an output for which `validate(output)` is false raises ValueError
+    and is not cached, so the caller's retry sends a fresh request.
+    """
     try:
-        client = Groq(api_key=GROQ_API_KEY)
-        response = client.chat.completions.create(
+        result, usage = cached_chat_completion(
+            validate=validate,
             messages=[
                 {
                     "role": "system",
@@ -40,24 +74,30 @@ def groq_model_generation(prompt: str, system_message: str, model: str) -> dict:
             temperature=0,
             response_format={"type": "json_object"},
         )
+        token_usage.add(usage)
 
-        result = response.choices[0].message.content
         logger.info(f"Response: {result}")
 
         # Parse result and raise exception if it's not valid JSON
         try:
-            return json.loads(result)
+            output = json.loads(result)
         except json.JSONDecodeError:
             logger.error("Invalid JSON output string")
             raise
+        if validate is not None and not validate(output):
+            raise ValueError(f"Model output is missing required fields: {result[:200]}")
+        return output
 
     except Exception as e:
         logger.error(f"An unexpected error occurred: {e}")
         raise
 
 
-def groq_inference(system_message: str, model_name: str, rule_name: str, sales_deck: str) -> typing.Optional[str]:
+def groq_inference(system_message: str, model_name: str, rule_name: str, sales_deck: str,
+                   with_confidence: bool = False) -> typing.Optional[str]:
     """Perform inference using the groq api models and return the generated response."""
+    confidence_field = (',\n    "confidence" (a number between 0 and 1 telling how sure you are of the label)'
+                        if with_confidence else "")
     input_text = f"""
     The rule is: {rule_name}
     The sales deck to evaluate is: {sales_deck}
@@ -65,33 +105,257 @@ def groq_inference(system_message: str, model_name: str, rule_name: str, sales_d
     "rule_name",
     "label",
     "part",
-    "suggestion"
+    "suggestion"{confidence_field}
     """
-    model_output = groq_model_generation(input_text, system_message, model_name)
+    model_output = groq_model_generation(input_text, system_message, model_name, validate=is_valid_verdict)
     return model_output
 
 
-def rule_check(rule: str, system_message: str, model_name: str, sales_deck: str):
+def is_valid_verdict(output) -> bool:
+    """A rule verdict must at least carry a boolean label to be used or cached."""
+    return isinstance(output, dict) and isinstance(output.get("label"), bool)
+
+
+def rule_check(rule: str, system_message: str, model_name: str, sales_deck: str, with_confidence: bool = False):
     rule_name = rule['rule_name']
     rule_text = rule['rule_text']
     complete_rule_text =f"{rule_name}: {rule_text}"
-    llm_result = groq_inference(system_message, model_name, complete_rule_text, sales_deck)
+    llm_result = groq_inference(system_message, model_name, complete_rule_text, sales_deck, with_confidence)
     return llm_result
 
-@st.cache_resource
-def fca_checker_results(rules_list: list, system_message: str, model_name: str, sales_deck: str, max_retries: int = 3):
+
+class CascadeStats:
+    """Thread-safe timing and agreement counters of the small-then-large model cascade."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.small_calls = 0
+        self.small_seconds = 0.0
+        self.large_calls = 0
+        self.large_seconds = 0.0
+        self.escalations = {'violation': 0, 'low_confidence': 0, 'invalid_output': 0}
+        self.compared = 0
+        self.agreed = 0
+
+    def record(self, tier: str, seconds: float):
+        with self._lock:
+            setattr(self, f"{tier}_calls", getattr(self, f"{tier}_calls") + 1)
+            setattr(self, f"{tier}_seconds", getattr(self, f"{tier}_seconds") + seconds)
+
+    def record_escalation(self, reason: str, small_label, large_label):
+        with self._lock:
+            self.escalations[reason] += 1
+            if isinstance(small_label, bool) and isinstance(large_label, bool):
+                self.compared += 1
+                self.agreed += small_label == large_label
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {
+                'small_calls': self.small_calls,
+                'small_seconds': round(self.small_seconds, 2),
+                'large_calls': self.large_calls,
+                'large_seconds': round(self.large_seconds, 2),
+                'escalations': dict(self.escalations),
+                'agreement_rate': round(self.agreed / self.compared, 2) if self.compared else None,
+            }
+
+
+def cascade_rule_check(rule: dict, system_message: str, small_model: str, large_model: str, sales_deck: str,
+                       stats: CascadeStats, min_confidence: float = 0.7) -> dict:
+    """Check a rule with the small model and re-check it with the large model only when needed.
+
+    The large model is called when the small model flags a violation, reports a
+    confidence below `min_confidence`, or returns an invalid verdict.
+    """
+    start = time.time()
+    try:
+        small_result = rule_check(rule, system_message, small_model, sales_deck, with_confidence=True)
+    except Exception as e:
+        logger.warning(f"Small model failed on rule '{rule['rule_name']}': {e}")
+        small_result = None
+    stats.record('small', time.time() - start)
+
+    small_label = small_result.get("label") if isinstance(small_result, dict) else None
+    try:
+        confidence = float(small_result.get("confidence", 0)) if small_label is not None else 0.0
+    except (TypeError, ValueError):
+        confidence = 0.0
+
+    if not isinstance(small_label, bool):
+        reason = 'invalid_output'
+    elif small_label == False:
+        reason = 'violation'
+    elif confidence < min_confidence:
+        reason = 'low_confidence'
+    else:
+        return small_result
+
+    start = time.time()
+    large_result = rule_check(rule, system_message, large_model, sales_deck)
+    stats.record('large', time.time() - start)
+    stats.record_escalation(reason, small_label, large_result.get("label"))
+    return large_result
+
+def batched_rule_check(rules: list, system_message: str, model_name: str, sales_deck: str) -> dict:
+    """Evaluate all rules in a single request and return the verdicts keyed by rule name."""
+    rules_text = "\n".join(f"{i + 1}. {rule['rule_name']}: {rule['rule_text']}" for i, rule in enumerate(rules))
+    input_text = f"""
+    Evaluate each of the following rules separately:
+    {rules_text}
+    The sales deck to evaluate is: {sales_deck}
+    You MUST provide an output in JSON representation with a single field "results",
+    a list holding one object per rule, in the same order, with the following fields:
+    "rule_name" (exactly as written above),
+    "label",
+    "part",
+    "suggestion"
+    """
+    model_output = groq_model_generation(
+        input_text, system_message, model_name,
+        validate=lambda output: isinstance(output, dict) and isinstance(output.get("results"), list),
+    )
+
+    rule_names = {" ".join(rule['rule_name'].lower().split()): rule['rule_name'] for rule in rules}
+    verdicts = {}
+    for verdict in model_output.get("results", []):
+        if not isinstance(verdict, dict):
+            continue
+        rule_name = rule_names.get(" ".join(str(verdict.get("rule_name", "")).lower().split()))
+        if rule_name and is_valid_verdict(verdict):
+            verdicts[rule_name] = verdict
+    missing = [rule['rule_name'] for rule in rules if rule['rule_name'] not in verdicts]
+    if missing:
+        logger.warning(f"Batched rule check returned no verdict for: {missing}")
+    return verdicts
+
+
+NO_RELATED_CONTENT = "no related content for this rule"
+
+
+def split_transcript(sales_deck: str, segment_words: int, overlap_words: int = 100) -> list[str]:
+    """Split the transcript into segments of `segment_words` words that overlap by `overlap_words`."""
+    if segment_words <= 0 or not 0 <= overlap_words < segment_words:
+        raise ValueError(f"Need 0 <= overlap_words < segment_words, got {overlap_words} and {segment_words}")
+    words = sales_deck.split()
+    if len(words) <= segment_words:
+        return [sales_deck]
+    step = segment_words - overlap_words
+    return [" ".join(words[start:start + segment_words]) for start in range(0, len(words) - overlap_words, step)]
+
+
+def merge_segment_results(rule_name: str, segment_results: list[dict]) -> dict:
+    """Merge the verdicts of one rule over all transcript segments into a single verdict.
+
+    The rule is violated if a segment flags a violation with concrete parts, or if
+    every segment flags it (e.g. a required warning is missing everywhere). Parts
+    and suggestions stay index-aligned and duplicate parts from overlaps are dropped.
+    """
+    def related_parts(result):
+        return [part for part in result.get("part") or [] if NO_RELATED_CONTENT not in str(part).lower()]
+
+    violating = [result for result in segment_results if result.get("label") == False]
+    violated_with_parts = [result for result in violating if related_parts(result)]
+    violated = bool(violated_with_parts) or (bool(segment_results) and len(violating) == len(segment_results))
+
+    parts, suggestions, seen = [], [], set()
+    if violated_with_parts:
+        for result in violated_with_parts:
+            result_suggestions = result.get("suggestion") or []
+            for i, part in enumerate(result.get("part") or []):
+                key = " ".join(str(part).lower().split())
+                if NO_RELATED_CONTENT in key or key in seen:
+                    continue
+                seen.add(key)
+                parts.append(part)
+                suggestions.append(result_suggestions[i] if i < len(result_suggestions) else "")
+    elif violated:
+        parts = [NO_RELATED_CONTENT]
+        suggestions = [next((s for result in violating for s in result.get("suggestion") or []), "")]
+    else:
+        for result in segment_results:
+            for part in related_parts(result):
+                key = " ".join(str(part).lower().split())
+                if key not in seen:
+                    seen.add(key)
+                    parts.append(part)
+
+    return {"rule_name": rule_name, "label": not violated, "part": parts, "suggestion": suggestions}
+
+
+def rule_check_windowed(rule: dict, segments: list[str], executor, check) -> dict:
+    """Check one rule against every transcript segment in parallel with `check(rule, segment)` and merge the verdicts."""
+    futures = [executor.submit(check, rule, segment) for segment in segments]
+    return merge_segment_results(rule['rule_name'], [future.result() for future in futures])
+
+
+def fca_checker_results(rules_list: list, system_message: str, model_name: str, sales_deck: str, max_retries: int = 3,
+                        batched: bool = False, segment_words: int = None, segment_overlap_words: int = 100,
+                        max_workers: int = 8, prefilter: bool = False, cascade_model: str = None,
+                        cascade_min_confidence: float = 0.7, prefilter_min_confidence: float = MIN_SKIP_CONFIDENCE):
+    """Check the sales deck against every rule.
+
+    With `batched=True` all rules are evaluated in one request, and any rule missing
+    from that response falls back to its own request.
+
+    With `segment_words` set, a transcript longer than that is split into overlapping
+    segments; each rule is checked on every segment in parallel (up to `max_workers`
+    requests at once) and the segment verdicts are merged. This mode replaces the
+    batched mode for long transcripts.
+
+    With `prefilter=True` a local classifier first drops rules that cannot apply
+    to the sales deck; they are reported under 'skipped_rules' with a confidence.
+    Rules it is less than `prefilter_min_confidence` sure about are still checked.
+
+    With `cascade_model` set (e.g. a fast 8B model), each per-rule check runs on
+    that model first and only violations, low-confidence and invalid verdicts are
+    re-checked with `model_name`; timings and agreement go under 'cascade_stats'.
+
+    Rules that still fail after `max_retries` are listed under 'failed_rules'; they
+    were not checked, so the output must not be taken (or cached) as a full review.
+    """
     not_respected_fca_handbooks = []
     not_respected_rules = []
     suggestions = []
 
+    skipped_rules = []
+    if prefilter:
+        rules_list, skipped_rules = prefilter_rules(rules_list, sales_deck, prefilter_min_confidence)
+
+    segments = split_transcript(sales_deck, segment_words, segment_overlap_words) if segment_words else [sales_deck]
+    if len(segments) > 1:
+        logger.info(f"Checking rules over {len(segments)} transcript segments")
+        batched = False
+    segment_executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+
+    cascade_stats = CascadeStats() if cascade_model else None
+
+    def check(rule, deck):
+        if cascade_model:
+            return cascade_rule_check(rule, system_message, cascade_model, model_name, deck, cascade_stats,
+                                      cascade_min_confidence)
+        return rule_check(rule, system_message, model_name, deck)
+
+    def evaluate_rule(rule):
+        if len(segments) > 1:
+            return rule_check_windowed(rule, segments, segment_executor, check)
+        return check(rule, sales_deck)
+
+    batched_results = {}
+    if batched:
+        try:
+            batched_results = batched_rule_check(rules_list, system_message, model_name, sales_deck)
+        except Exception as e:
+            print(f"Batched rule check failed, falling back to per-rule calls. Error: {e}")
+
     # Function to process a single rule with retry logic
     def process_rule_with_retry(rule, retries=0):
         rule_name = rule["rule_name"]
         handbooks = rule["handbooks"]
 
         try:
-            # Simulate the rule check function
-            llm_result = rule_check(rule, system_message, model_name, sales_deck)
+            # Use the batched verdict once, a retry always issues a per-rule request
+            llm_result = batched_results.pop(rule_name, None) or evaluate_rule(rule)
 
             if llm_result["label"] == False:
                 return {
@@ -103,20 +367,23 @@ def fca_checker_results(rules_list: list, system_message: str, model_name: str,
         except Exception as e:
             if retries < max_retries:
                 print(f"Error processing rule '{rule_name}'. Retrying ({retries + 1}/{max_retries})...")
-                time.sleep(1)  # Optional: Add delay before retry
+                # Rate limits are retried by the shared limiter; this covers invalid outputs, with jitter
+                # so the rule threads do not retry in lockstep
+                time.sleep(random.uniform(0, 2 ** retries))
                 return process_rule_with_retry(rule, retries + 1)
             else:
                 print(f"Failed to process rule '{rule_name}' after {max_retries} retries. Error: {e}")
-                return None
+                return {'rule_name': rule_name, 'failed': True}
 
     # Use ThreadPoolExecutor to process rules in parallel
-    with concurrent.futures.ThreadPoolExecutor() as executor:
+    with segment_executor, concurrent.futures.ThreadPoolExecutor() as executor:
         # Map the process_rule_with_retry function to each rule in rules_list
         results = list(executor.map(process_rule_with_retry, rules_list))
 
     # Process the results after parallel execution
+    failed_rules = [result['rule_name'] for result in results if result and result.get('failed')]
     for result in results:
-        if result:
+        if result and not result.get('failed'):
             rule_name = result['rule_name']
             handbooks = result['handbooks']
             llm_result = result['llm_result']
@@ -136,13 +403,17 @@ def fca_checker_results(rules_list: list, system_message: str, model_name: str,
 
     output_dict = {'not_respected_fca_handbooks': unique_not_respected_fca_handbooks,
                    'not_respected_rules': unique_not_respected_rules,
-                   'suggestions': suggestions
+                   'suggestions': suggestions,
+                   'skipped_rules': skipped_rules,
+                   'failed_rules': failed_rules
                    }
+    if cascade_stats:
+        output_dict['cascade_stats'] = cascade_stats.to_dict()
+        logger.info(f"Cascade stats: {output_dict['cascade_stats']}")
     return output_dict
 
 
 # Video Processing functions
-@st.cache_resource
 def video_card_generation(transcript: str, model: str) -> str:
     """Model names: llama3_1, mixtral, gemma"""
     system_message = """
@@ -167,8 +438,7 @@ def video_card_generation(transcript: str, model: str) -> str:
     - Product Summary: A portfolio management tool that assists investors in tracking and optimizing their asset allocations for improved investment outcomes.
     """
     try:
-        client = Groq(api_key=GROQ_API_KEY)
-        response = client.chat.completions.create(
+        result, usage = cached_chat_completion(
             messages=[
                 {
                     "role": "system",
@@ -182,15 +452,14 @@ def video_card_generation(transcript: str, model: str) -> str:
             model=model,
             temperature=0,
         )
+        token_usage.add(usage)
 
-        result = response.choices[0].message.content
         logger.info(f"Response: {result}")
         return result
     except Exception as e:
         logger.error(f"An unexpected error occurred: {e}")
         raise
 
-@st.cache_resource
 def reviewed_transcript(transcript: str, partes_and_suggestions_to_follow: list[dict], model: str):
     system_message = """ Your task is to update only the specific sections in the provided text based on the suggestions given.
         Make sure not to alter any other parts of the text. The overall tone should remain consistent, professional, and appropriate for a financial product.
@@ -198,8 +467,7 @@ def reviewed_transcript(transcript: str, partes_and_suggestions_to_follow: list[
         Return the final updated text in a JSON format under the key 'optimized_transcript'."""
 
     try:
-        client = Groq(api_key=GROQ_API_KEY)
-        response = client.chat.completions.create(
+        result, usage = cached_chat_completion(
             messages=[
                 {
                     "role": "system",
@@ -215,9 +483,11 @@ def reviewed_transcript(transcript: str, partes_and_suggestions_to_follow: list[
             model=model,
             response_format={"type": "json_object"},
             temperature=0,
+            # A reply without the rewritten text must not be served again from the cache
+            validate=lambda output: isinstance(output, dict) and isinstance(output.get('optimized_transcript'), str),
         )
+        token_usage.add(usage)
 
-        result = response.choices[0].message.content
         logger.info(f"Response: {result}")
         try:
             generated_result = json.loads(result)
@@ -0,0 +1,239 @@
+import logging
+import multiprocessing
+import os
+import sqlite3
+import threading
+import time
+import traceback
+import uuid
+
+import groq_client
+from result_cache import decode_value, encode_value
+
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+JOB_DB_PATH = os.getenv("BERRYPIE_JOB_DB_PATH", os.path.join("cache", "jobs.sqlite3"))
+# Number of worker processes, i.e. the cap on concurrent heavy reviews per server
+JOB_WORKERS = int(os.getenv("BERRYPIE_JOB_WORKERS", 2))
+JOB_POLL_SECONDS = 1.0
+# Finished jobs hold full transcripts and results, so they are deleted once this old
+JOB_RETENTION_SECONDS = float(os.getenv("BERRYPIE_JOB_RETENTION_HOURS", 24)) * 3600
+# How often an idle worker purges expired jobs
+JOB_PURGE_INTERVAL_SECONDS = 3600
+
+
+def _review_video_job(payload: dict, progress, publish) -> dict:
+    # Imported here so the Streamlit process does not pay for it until a job runs
+    from review_pipeline import review_video
+    options = {key: payload[key] for key in ("model_name", "frame_extractor", "scene_probe_seconds") if key in payload}
+    return review_video(payload['video_path'], progress=progress, publish=publish, **options)
+
+
+# Job kind -> handler(payload, progress, publish) returning the job result
+JOB_HANDLERS = {
+    "review_video": _review_video_job,
+}
+
+
+class JobQueue:
+    """SQLite-backed queue of review jobs shared by the Streamlit server and its worker processes.
+
+    A job moves from queued to running to done or failed; `stage` tells which
+    pipeline stage a running job is in, and `partial` holds results published
+    before the job finishes.
+    """
+
+    def __init__(self, path: str = JOB_DB_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._connection = sqlite3.connect(path, check_same_thread=False, timeout=30, isolation_level=None)
+        with self._lock:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                """CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    stage TEXT,
+                    partial TEXT NOT NULL DEFAULT '{}',
+                    result TEXT,
+                    error TEXT,
+                    worker_pid INTEGER,
+                    created_at REAL NOT NULL,
+                    started_at REAL,
+                    finished_at REAL
+                )"""
+            )
+            self._connection.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+
+    def _execute(self, query: str, params: tuple = ()):
+        with self._lock:
+            return self._connection.execute(query, params).fetchall()
+
+    def submit(self, kind: str, payload: dict) -> str:
+        """Queue a job and return its ID."""
+        if kind not in JOB_HANDLERS:
+            raise ValueError(f"Unknown job kind: {kind}")
+        job_id = uuid.uuid4().hex
+        self._execute(
+            "INSERT INTO jobs (id, kind, payload, status, stage, created_at) VALUES (?, ?, ?, 'queued', 'queued', ?)",
+            (job_id, kind, encode_value(payload), time.time()),
+        )
+        logger.info(f"Queued {kind} job {job_id}")
+        return job_id
+
+    def get(self, job_id: str) -> dict:
+        """Return the job as a dict, or None if it does not exist."""
+        rows = self._execute(
+            "SELECT id, kind, status, stage, partial, result, error, created_at, started_at, finished_at "
+            "FROM jobs WHERE id = ?", (job_id,),
+        )
+        if not rows:
+            return None
+        job_id, kind, status, stage, partial, result, error, created_at, started_at, finished_at = rows[0]
+        return {
+            'id': job_id, 'kind': kind, 'status': status, 'stage': stage,
+            'partial': decode_value(partial), 'result': decode_value(result) if result else None, 'error': error,
+            'created_at': created_at, 'started_at': started_at, 'finished_at': finished_at,
+        }
+
+    def claim(self) -> tuple:
+        """Atomically take the oldest queued job; returns (job_id, kind, payload) or None."""
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._connection.execute(
+                    "SELECT id, kind, payload FROM jobs WHERE status = 'queued' ORDER BY created_at LIMIT 1"
+                ).fetchone()
+                if row:
+                    self._connection.execute(
+                        "UPDATE jobs SET status = 'running', started_at = ?, worker_pid = ? WHERE id = ?",
+                        (time.time(), os.getpid(), row[0]),
+                    )
+                self._connection.execute("COMMIT")
+            except Exception:
+                self._connection.execute("ROLLBACK")
+                raise
+        return (row[0], row[1], decode_value(row[2])) if row else None
+
+    def set_stage(self, job_id: str, stage: str):
+        self._execute("UPDATE jobs SET stage = ? WHERE id = ?", (stage, job_id))
+
+    def publish_partial(self, job_id: str, key: str, value):
+        """Expose an intermediate result (e.g. the transcript) before the job finishes."""
+        with self._lock:
+            row = self._connection.execute("SELECT partial FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            partial = decode_value(row[0]) if row else {}
+            partial[key] = value
+            self._connection.execute("UPDATE jobs SET partial = ? WHERE id = ?", (encode_value(partial), job_id))
+
+    def complete(self, job_id: str, result):
+        self._execute(
+            "UPDATE jobs SET status = 'done', stage = 'done', result = ?, finished_at = ? WHERE id = ?",
+            (encode_value(result), time.time(), job_id),
+        )
+
+    def fail(self, job_id: str, error: str):
+        self._execute(
+            "UPDATE jobs SET status = 'failed', error = ?, finished_at = ? WHERE id = ?",
+            (error, time.time(), job_id),
+        )
+
+    def active_payloads(self) -> list:
+        """Return the payloads of the queued and running jobs."""
+        rows = self._execute("SELECT payload FROM jobs WHERE status IN ('queued', 'running')")
+        return [decode_value(payload) for payload, in rows]
+
+    def purge_finished(self, max_age_seconds: float = JOB_RETENTION_SECONDS) -> int:
+        """Delete done and failed jobs that finished more than `max_age_seconds` ago; returns how many."""
+        with self._lock:
+            deleted = self._connection.execute(
+                "DELETE FROM jobs WHERE status IN ('done', 'failed') AND finished_at < ?",
+                (time.time() - max_age_seconds,),
+            ).rowcount
+        if deleted:
+            logger.info(f"Purged {deleted} finished job(s)")
+        return deleted
+
+    def requeue_orphans(self):
+        """Put back jobs whose worker process died while running them."""
+        for job_id, worker_pid in self._execute("SELECT id, worker_pid FROM jobs WHERE status = 'running'"):
+            if not _pid_alive(worker_pid):
+                self._execute("UPDATE jobs SET status = 'queued', stage = 'queued' WHERE id = ?", (job_id,))
+                logger.warning(f"Requeued job {job_id} of dead worker {worker_pid}")
+
+
+def _pid_alive(pid: int) -> bool:
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def worker_loop(path: str = JOB_DB_PATH, poll_seconds: float = JOB_POLL_SECONDS, processes: int = 1):
+    """Claim and run jobs forever; this is the target of each worker process.
+
+    `processes` is the number of processes sharing the Groq account limits, this one included.
+    """
+    groq_client.share_rate_limits(processes)
+    queue = JobQueue(path)
+    logger.info(f"Job worker {os.getpid()} started")
+    last_purge = time.time()
+    while True:
+        job = queue.claim()
+        if job is None:
+            if time.time() - last_purge > JOB_PURGE_INTERVAL_SECONDS:
+                queue.purge_finished()
+                last_purge = time.time()
+            time.sleep(poll_seconds)
+            continue
+
+        job_id, kind, payload = job
+        logger.info(f"Worker {os.getpid()} running {kind} job {job_id}")
+
+        def progress(stage, job_id=job_id):
+            queue.set_stage(job_id, stage)
+
+        def publish(key, value, job_id=job_id):
+            queue.publish_partial(job_id, key, value)
+
+        try:
+            result = JOB_HANDLERS[kind](payload, progress, publish)
+            queue.complete(job_id, result)
+            logger.info(f"Job {job_id} done")
+        except Exception as e:
+            logger.error(f"Job {job_id} failed: {e}")
+            queue.fail(job_id, f"{e}\n{traceback.format_exc()}")
+
+
+def start_workers(count: int = JOB_WORKERS, path: str = JOB_DB_PATH) -> list:
+    """Start `count` daemon worker processes; spawned, so they do not inherit the Streamlit server state.
+
+    The account rate limits are split between the workers and the calling process.
+    Finished jobs past the retention period are purged here and then hourly by idle workers.
+    """
+    processes = count + 1
+    groq_client.share_rate_limits(processes)
+    queue = JobQueue(path)
+    queue.purge_finished()
+    queue.requeue_orphans()
+    context = multiprocessing.get_context("spawn")
+    workers = []
+    for _ in range(count):
+        worker = context.Process(target=worker_loop, args=(path, JOB_POLL_SECONDS, processes), daemon=True)
+        worker.start()
+        workers.append(worker)
+    logger.info(f"Started {count} job worker process(es)")
+    return workers
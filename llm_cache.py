@@ -0,0 +1,125 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from groq_client import create_chat_completion
+
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("BERRYPIE_LLM_CACHE_MAX_ENTRIES", 2048))
+LLM_CACHE_MAX_BYTES = int(os.getenv("BERRYPIE_LLM_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+LLM_CACHE_TTL_SECONDS = int(os.getenv("BERRYPIE_LLM_CACHE_TTL_SECONDS", 6 * 60 * 60))
+
+
+class LLMResponseCache:
+    """Thread-safe in-memory cache of LLM response texts with LRU and TTL eviction and a memory budget."""
+
+    def __init__(self, max_entries: int = LLM_CACHE_MAX_ENTRIES, max_bytes: int = LLM_CACHE_MAX_BYTES,
+                 ttl_seconds: int = LLM_CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (expires_at, value, size)
+        self.clear()
+
+    @staticmethod
+    def make_key(model: str, messages: list, temperature, **options) -> str:
+        """Hash everything that determines the response: model, system and user messages, temperature and options."""
+        payload = json.dumps(
+            {"model": model, "messages": messages, "temperature": temperature, "options": options},
+            sort_keys=True, default=str,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str):
+        """Return the cached response text, or None on a miss or an expired entry."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key: str, value: str):
+        size = len(value.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, value, size)
+            self.current_bytes += size
+            while len(self._entries) > self.max_entries or self.current_bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self.current_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+    def _remove(self, key: str):
+        _, _, size = self._entries.pop(key)
+        self.current_bytes -= size
+
+
+llm_cache = LLMResponseCache()
+
+
+def cached_chat_completion(validate=None, **kwargs):
+    """Return (content, usage) for a chat completion, serving repeated prompts from `llm_cache`.
+
+    `usage` is None when the response came from the cache. With `validate`, a
+    JSON response is only cached if `validate(parsed_json)` is true, so a reply
+    the caller rejects is requested again on retry instead of served from the cache.
+    """
+    options = {name: value for name, value in kwargs.items() if name not in ("model", "messages", "temperature")}
+    key = llm_cache.make_key(kwargs["model"], kwargs["messages"], kwargs.get("temperature"), **options)
+    content = llm_cache.get(key)
+    if content is not None:
+        logger.info(f"LLM cache hit for {kwargs['model']}")
+        return content, None
+
+    response = create_chat_completion(**kwargs)
+    content = response.choices[0].message.content
+    if content is not None and _is_cacheable(content, kwargs.get("response_format"), validate):
+        llm_cache.set(key, content)
+    return content, response.usage
+
+
+def _is_cacheable(content: str, response_format, validate=None) -> bool:
+    # Invalid JSON, or JSON the caller rejects, must not be cached, or every retry of the prompt would get it back
+    if (response_format and response_format.get("type") == "json_object") or validate is not None:
+        try:
+            data = json.loads(content)
+        except json.JSONDecodeError:
+            return False
+        if validate is not None and not validate(data):
+            return False
+    return True
@@ -1,12 +1,18 @@
-import streamlit as st
 import os
 import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
 from typing import List
-from langchain_community.document_loaders import PyPDFLoader
+from pypdf import PdfReader
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_community.vectorstores import FAISS
 from langchain_community.embeddings import HuggingFaceEmbeddings
 
+from pdf_workers import parse_page_range
+from result_cache import file_sha256, get_result_cache
+
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -14,39 +20,142 @@ logger = logging.getLogger(__name__)
 # Set up Streamlit secrets for Google API key   
 # os.environ["GOOGLE_API_KEY"] = st.secrets["GOOGLE_API_KEY"]
 
-# Function to process PDF files and create a retriever
+EMBEDDING_MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 150
+# Number of chunks injected into each chatbot request
+RAG_TOP_K = 4
+
+PDF_PARSE_WORKERS = max(1, min(4, os.cpu_count() or 1))
+# Large files are split into tasks of this many pages, so one prospectus is parsed by several processes
+PAGES_PER_TASK = 20
+# Bump when the text extraction changes, so cached page texts are not reused
+PDF_PARSER_VERSION = "pypdf-pages-1"
+
+
+@lru_cache(maxsize=None)
+def get_parse_pool(max_workers: int = PDF_PARSE_WORKERS) -> ProcessPoolExecutor:
+    """Return the long-lived pool of PDF parse processes, so they are only started once per process.
+
+    Spawned, not forked: forking the multi-threaded Streamlit server can deadlock the children.
+    """
+    return ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn"))
 
-@st.cache_resource
-def process_pdf(paths: List[str]) -> str:
-    all_text = []
-    logger.info(f"Starting PDF processing for {len(paths)} file(s)")
 
-    for path in paths:
+def _parse_pool(task_count: int, max_workers: int):
+    # Worker processes cannot start processes of their own, and a single task gains nothing from a pool
+    if task_count == 1 or max_workers == 1 or multiprocessing.current_process().daemon:
+        return None
+    return get_parse_pool(max_workers)
+
+
+def iter_pdf_pages(paths: List[str], max_workers: int = None):
+    """Parse PDFs across a process pool and yield (path, page_number, page_count, text) as pages finish.
+
+    Page texts are cached by the file's SHA-256, so a PDF is parsed once whatever its
+    saved file name; cached files are yielded first, without starting the pool.
+    """
+    result_cache = get_result_cache()
+    files = {}
+    tasks = []
+    for path in dict.fromkeys(paths):
         logger.info(f"Attempting to load document from {path}")
         try:
-            loader = PyPDFLoader(path)
-            docs = loader.load()
-            logger.info(f"Successfully loaded {len(docs)} page(s) from {path}")
-
-            for doc in docs:
-                all_text.append(doc.page_content)
-                
+            digest = file_sha256(path)
+            cached_pages = result_cache.get("pdf_text", digest, version=PDF_PARSER_VERSION)
+            if cached_pages is not None:
+                for page_number, text in enumerate(cached_pages):
+                    yield path, page_number, len(cached_pages), text
+                continue
+            page_count = len(PdfReader(path).pages)
         except Exception as e:
             logger.error(f"Error loading {path}: {str(e)}")
             continue
+        files[path] = {'digest': digest, 'pages': [None] * page_count, 'failed': False}
+        tasks.extend(
+            (path, start, min(start + PAGES_PER_TASK, page_count)) for start in range(0, page_count, PAGES_PER_TASK)
+        )
+
+    if not tasks:
+        return
+    pool = _parse_pool(len(tasks), max_workers or PDF_PARSE_WORKERS)
+    executor = pool or ThreadPoolExecutor(max_workers=1)
+    futures = {executor.submit(parse_page_range, *task): task for task in tasks}
+    try:
+        for future in as_completed(futures):
+            path, start, stop = futures[future]
+            parsed = files[path]
+            try:
+                texts = future.result()
+            except Exception as e:
+                logger.error(f"Error parsing pages {start + 1}-{stop} of {path}: {str(e)}")
+                if isinstance(e, BrokenProcessPool):
+                    # A crashed worker breaks the whole pool; the next call starts a new one
+                    get_parse_pool.cache_clear()
+                parsed['failed'] = True
+                texts = [""] * (stop - start)
+            for offset, text in enumerate(texts):
+                parsed['pages'][start + offset] = text
+                yield path, start + offset, len(parsed['pages']), text
 
+            if not parsed['failed'] and all(page is not None for page in parsed['pages']):
+                logger.info(f"Successfully loaded {len(parsed['pages'])} page(s) from {path}")
+                result_cache.set("pdf_text", parsed['digest'], parsed['pages'], version=PDF_PARSER_VERSION)
+    finally:
+        # The shared pool stays up; only drop the tasks nobody is waiting for any more
+        for future in futures:
+            future.cancel()
+        if pool is None:
+            executor.shutdown()
+
+
+# Function to process PDF files
+def process_pdf(paths: List[str], on_page=None) -> str:
+    """Return the text of all pages of the PDFs, in file and page order.
+
+    `on_page(path, page_number, page_count)` is called as each page is parsed, when given.
+    """
+    logger.info(f"Starting PDF processing for {len(paths)} file(s)")
+
+    pages_by_path = {path: {} for path in paths}
+    for path, page_number, page_count, text in iter_pdf_pages(paths):
+        pages_by_path[path][page_number] = text
+        if on_page is not None:
+            on_page(path, page_number, page_count)
+
+    all_text = [text for pages in pages_by_path.values() for _, text in sorted(pages.items())]
     combined_text = "\n\n".join(all_text)
     logger.info(f"Extracted text from {len(all_text)} page(s) in total")
     logger.info(f"Extracted text is: {combined_text[:100]}")
     return combined_text
 
 
+@lru_cache(maxsize=None)
+def get_embeddings() -> HuggingFaceEmbeddings:
+    """Load the sentence-transformers embedding model once per process."""
+    return HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL_NAME)
+
+
+def split_text(text: str) -> List[str]:
+    """Split the parsed document text into overlapping chunks for retrieval."""
+    splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+    return splitter.split_text(text)
+
+
+def build_vectordb(text: str):
+    """Chunk the text returned by `process_pdf` and index it in FAISS; returns None if there is no text."""
+    chunks = split_text(text) if text else []
+    if not chunks:
+        return None
+    vectordb = FAISS.from_texts(chunks, get_embeddings())
+    logger.info(f"Indexed {len(chunks)} chunk(s) for retrieval")
+    return vectordb
+
+
 # Function to search the retriever with a query
-def rag_tool(query: str, vectordb) -> list:
+def rag_tool(query: str, vectordb, k: int = RAG_TOP_K) -> list:
     """
     Takes a query string and a vector store,
-    performs retrieval, and returns the top 3 matching chunks.
+    performs retrieval, and returns the top k matching chunks.
     """
-    retriever = vectordb.as_retriever(search_kwargs={"k": 3})
-    results = retriever.get_relevant_documents(query)
-    return results
\ No newline at end of file
+    return vectordb.similarity_search(query, k=k)
\ No newline at end of file
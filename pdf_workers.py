@@ -0,0 +1,25 @@
+import logging
+from typing import List
+
+from pypdf import PdfReader
+
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Runs in the spawned parse processes, which import this module and nothing heavier:
+# pdf_parsing would load langchain, FAISS and the embedding stack before any page is parsed
+
+
+def parse_page_range(path: str, start: int, stop: int) -> List[str]:
+    """Extract the text of pages [start, stop) of a PDF; runs in a worker process."""
+    reader = PdfReader(path)
+    texts = []
+    for page_number in range(start, stop):
+        try:
+            texts.append(reader.pages[page_number].extract_text() or "")
+        except Exception as e:
+            logger.error(f"Error extracting page {page_number + 1} of {path}: {str(e)}")
+            texts.append("")
+    return texts
@@ -0,0 +1,142 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from functools import lru_cache
+
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+CACHE_PATH = os.getenv("BERRYPIE_CACHE_PATH", os.path.join("cache", "results.sqlite3"))
+CACHE_MAX_BYTES = int(os.getenv("BERRYPIE_CACHE_MAX_BYTES", 512 * 1024 * 1024))
+
+
+def file_sha256(path: str, chunk_size: int = 1 << 20) -> str:
+    """Return the SHA-256 hex digest of a file, read in chunks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def text_sha256(text: str) -> str:
+    """Return the SHA-256 hex digest of a string."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def rules_version(rules_list: list, system_message: str) -> str:
+    """Return a short fingerprint of the rules and system message, so edited rules never hit old reviews."""
+    payload = json.dumps({"rules": rules_list, "system_message": system_message}, sort_keys=True)
+    return text_sha256(payload)[:16]
+
+
+def encode_value(value) -> str:
+    """Serialize a pipeline output to JSON; review outputs hold sets, which JSON cannot represent natively."""
+    return json.dumps(value, default=lambda obj: {"__set__": sorted(obj)} if isinstance(obj, set) else str(obj))
+
+
+def decode_value(payload: str):
+    """Inverse of `encode_value`."""
+    return json.loads(payload, object_hook=lambda obj: set(obj["__set__"]) if set(obj) == {"__set__"} else obj)
+
+
+class ResultCache:
+    """SQLite-backed cache of pipeline outputs keyed by the content hash of the reviewed asset.
+
+    Keys combine a namespace (the pipeline stage), the asset's SHA-256, the model
+    name and a version string. Once the stored values exceed `max_bytes`, the least
+    recently used entries are evicted.
+    """
+
+    def __init__(self, path: str = CACHE_PATH, max_bytes: int = CACHE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._connection = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        with self._lock, self._connection:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                """CREATE TABLE IF NOT EXISTS results (
+                    key TEXT PRIMARY KEY,
+                    namespace TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL
+                )"""
+            )
+            self._connection.execute("CREATE INDEX IF NOT EXISTS results_accessed_at ON results (accessed_at)")
+
+    @staticmethod
+    def make_key(namespace: str, content_hash: str, model: str = "", version: str = "") -> str:
+        return hashlib.sha256("\x1f".join([namespace, content_hash, model, version]).encode("utf-8")).hexdigest()
+
+    def get(self, namespace: str, content_hash: str, model: str = "", version: str = ""):
+        """Return the cached value, or None on a miss."""
+        key = self.make_key(namespace, content_hash, model, version)
+        with self._lock, self._connection:
+            row = self._connection.execute("SELECT value FROM results WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                logger.info(f"Result cache miss for {namespace}")
+                return None
+            self._connection.execute("UPDATE results SET accessed_at = ? WHERE key = ?", (time.time(), key))
+        logger.info(f"Result cache hit for {namespace}")
+        return decode_value(row[0])
+
+    def set(self, namespace: str, content_hash: str, value, model: str = "", version: str = ""):
+        """Store a value and evict old entries if the cache is over budget."""
+        key = self.make_key(namespace, content_hash, model, version)
+        payload = encode_value(value)
+        now = time.time()
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO results (key, namespace, value, size, created_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, namespace, payload, len(payload), now, now),
+            )
+            self._evict()
+
+    def cached(self, namespace: str, content_hash: str, compute, model: str = "", version: str = "",
+               cacheable=None):
+        """Return the cached value or compute, store and return it.
+
+        None results, and results for which `cacheable(value)` is false (e.g. partial
+        failures), are returned but not cached.
+        """
+        value = self.get(namespace, content_hash, model, version)
+        if value is None:
+            value = compute()
+            if value is not None and (cacheable is None or cacheable(value)):
+                self.set(namespace, content_hash, value, model, version)
+            elif value is not None:
+                logger.info(f"Not caching incomplete {namespace} result")
+        return value
+
+    def _evict(self):
+        total = self._connection.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        evicted = 0
+        rows = self._connection.execute("SELECT key, size FROM results ORDER BY accessed_at").fetchall()
+        for key, size in rows:
+            if total <= self.max_bytes:
+                break
+            self._connection.execute("DELETE FROM results WHERE key = ?", (key,))
+            total -= size
+            evicted += 1
+        logger.info(f"Result cache evicted {evicted} entr{'y' if evicted == 1 else 'ies'}")
+
+
+@lru_cache(maxsize=None)
+def get_result_cache() -> ResultCache:
+    """Return the process-wide result cache."""
+    return ResultCache()
@@ -0,0 +1,167 @@
+import logging
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from fca_rules_updated import default_system_message, rules_list
+from groq_models_v2 import fca_checker_results
+from pdf_parsing import process_pdf
+from result_cache import file_sha256, get_result_cache, rules_version
+from rule_prefilter import MIN_SKIP_CONFIDENCE
+from video_processing import (
+    SCENE_PROBE_SECONDS, WHISPER_MODEL, extract_audio_from_video, extract_speech_audio, has_audio_stream,
+    transcribe_audio_with_whisper, video_media_processing,
+)
+
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL = "llama-3.3-70b-versatile"
+# Transcripts longer than this many words are reviewed segment by segment
+REVIEW_SEGMENT_WORDS = 1500
+REVIEW_SEGMENT_OVERLAP_WORDS = 100
+# Options of fca_checker_results for reviews; they are part of the cache version, so changing one
+# never serves reviews computed with the old settings
+REVIEW_OPTIONS = {
+    'segment_words': REVIEW_SEGMENT_WORDS,
+    'segment_overlap_words': REVIEW_SEGMENT_OVERLAP_WORDS,
+    'prefilter': True,
+    'prefilter_min_confidence': MIN_SKIP_CONFIDENCE,
+}
+
+VIDEO_EXTENSIONS = (".mp4", ".mov", ".avi", ".mkv")
+PDF_EXTENSIONS = (".pdf",)
+
+
+def transcribe_video(video_path: str) -> str:
+    """Extract the speech audio of a video in memory and transcribe it, falling back to moviepy if ffmpeg fails.
+
+    A video without an audio track has an empty transcript; None means transcription failed.
+    """
+    if has_audio_stream(video_path) is False:
+        logger.info(f"{video_path} has no audio track, nothing to transcribe")
+        return ""
+
+    audio = extract_speech_audio(video_path)
+    if audio is not None:
+        return transcribe_audio_with_whisper(audio, "audio.flac")
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        audio_path = extract_audio_from_video(video_path, os.path.join(temp_dir, "extracted_audio.mp3"))
+        return transcribe_audio_with_whisper(audio_path) if audio_path else None
+
+
+def review_transcript(sales_deck: str, content_hash: str, model_name: str = DEFAULT_MODEL,
+                      system_message: str = default_system_message, rules: list = rules_list) -> dict:
+    """Check a sales deck against the FCA rules, cached by the content hash of the reviewed asset."""
+    if not sales_deck.strip():
+        # Nothing is said in the asset, so there is nothing for the rules to flag
+        return {'not_respected_fca_handbooks': set(), 'not_respected_rules': set(), 'suggestions': [],
+                'skipped_rules': [], 'failed_rules': []}
+    return get_result_cache().cached(
+        "fca_review", content_hash,
+        lambda: fca_checker_results(rules, system_message, model_name, sales_deck, **REVIEW_OPTIONS),
+        model=model_name,
+        version=";".join([rules_version(rules, system_message)]
+                         + [f"{name}={value}" for name, value in sorted(REVIEW_OPTIONS.items())]),
+        # A review with unchecked rules must not be served later as a complete verdict
+        cacheable=lambda output: not output.get('failed_rules'),
+    )
+
+
+def review_video(video_path: str, model_name: str = DEFAULT_MODEL, frame_extractor: str = "groq",
+                 progress=None, publish=None, scene_probe_seconds: float = SCENE_PROBE_SECONDS) -> dict:
+    """Run the full review of a video: transcription, frame OCR, disclaimer check and FCA rules.
+
+    The audio chain (extraction, transcription, rule checks) and the frame chain
+    (sampling, OCR, disclaimer check) run concurrently, so the rule checks start as
+    soon as the transcript is ready. `progress(stage)` is called as each stage starts
+    and `publish(key, value)` receives the transcript before the review finishes, when given.
+    `scene_probe_seconds` is the frame scene-change probe step, 0 to disable it.
+    """
+    progress = progress or (lambda stage: None)
+    publish = publish or (lambda key, value: None)
+    result_cache = get_result_cache()
+    video_digest = file_sha256(video_path)
+
+    progress("transcribing")
+    # Stops the frame OCR early if the audio chain fails, instead of waiting for every frame
+    stop_frames = threading.Event()
+    executor = ThreadPoolExecutor(max_workers=1)
+    try:
+        frames_future = executor.submit(video_media_processing, video_path, frame_extractor, stop_frames,
+                                        scene_probe_seconds)
+
+        transcript = result_cache.cached(
+            "transcript", video_digest, lambda: transcribe_video(video_path), model=WHISPER_MODEL
+        )
+        # An empty transcript (silent video) still gets its frames and disclaimer checked
+        if transcript is None:
+            raise RuntimeError("Transcription failed")
+        publish("transcript", transcript)
+
+        progress("reviewing")
+        transcript_review_output = review_transcript(transcript, video_digest, model_name)
+
+        if not frames_future.done():
+            progress("processing_frames")
+        video_review_output = frames_future.result()
+    except Exception:
+        stop_frames.set()
+        raise
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    return {
+        'sha256': video_digest,
+        'transcript': transcript,
+        'transcript_review_output': transcript_review_output,
+        'video_review_output': video_review_output,
+    }
+
+
+def review_pdf(pdf_path: str, model_name: str = DEFAULT_MODEL, progress=None) -> dict:
+    """Review the text of a PDF promotion against the FCA rules."""
+    progress = progress or (lambda stage: None)
+    pdf_digest = file_sha256(pdf_path)
+
+    progress("parsing")
+    text = process_pdf([pdf_path])
+    if not text:
+        raise RuntimeError("No text could be extracted from the PDF")
+
+    progress("reviewing")
+    transcript_review_output = review_transcript(text, pdf_digest, model_name)
+    return {
+        'sha256': pdf_digest,
+        'transcript': text,
+        'transcript_review_output': transcript_review_output,
+    }
+
+
+def review_asset(path: str, model_name: str = DEFAULT_MODEL, frame_extractor: str = "groq", progress=None,
+                 scene_probe_seconds: float = SCENE_PROBE_SECONDS) -> dict:
+    """Review a video or PDF and return a report record; errors are reported in the record, not raised."""
+    start = time.time()
+    record = {'path': path}
+    try:
+        if path.lower().endswith(VIDEO_EXTENSIONS):
+            record['type'] = "video"
+            record.update(review_video(path, model_name, frame_extractor, progress,
+                                       scene_probe_seconds=scene_probe_seconds))
+        elif path.lower().endswith(PDF_EXTENSIONS):
+            record['type'] = "pdf"
+            record.update(review_pdf(path, model_name, progress))
+        else:
+            raise ValueError(f"Unsupported file type: {path}")
+        record['status'] = "ok"
+    except Exception as e:
+        logger.error(f"Review of {path} failed: {e}")
+        record['status'] = "error"
+        record['error'] = str(e)
+    record['seconds'] = round(time.time() - start, 2)
+    return record
@@ -0,0 +1,103 @@
+import logging
+import re
+from functools import lru_cache
+
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+EMBEDDING_MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+# Sentence-to-rule cosine similarity above which a scoped rule is considered applicable
+SIMILARITY_THRESHOLD = 0.45
+# Not-applicable verdicts less confident than this are still sent to the LLM; a lexicon-only verdict scores 0.6
+MIN_SKIP_CONFIDENCE = 0.7
+
+# Rules that only apply to some products, with the terms that signal those products.
+# Rules not listed here apply to every sales deck and are never skipped.
+RULE_LEXICONS = {
+    "Disclosure of Risks for Credit and BNPL Offers": [
+        "buy now pay later", "buy now, pay later", "bnpl", "pay later", "pay in 3", "pay in three",
+        "credit", "loan", "borrow", "borrowing", "lend", "lender", "lending", "interest", "interest-free",
+        "apr", "instalment", "instalments", "installment", "installments", "finance", "financing",
+        "debt", "repayment", "repayments", "repay", "overdraft", "mortgage", "credit card", "credit rating",
+        "credit score",
+    ],
+}
+
+
+def _lexicon_pattern(terms: list) -> re.Pattern:
+    return re.compile(r"\b(" + "|".join(re.escape(term) for term in terms) + r")\b", re.IGNORECASE)
+
+
+@lru_cache(maxsize=None)
+def _get_embedding_model():
+    """Load the sentence-transformers model once, or return None if it is not installed."""
+    try:
+        from sentence_transformers import SentenceTransformer
+    except ImportError:
+        logger.warning("sentence-transformers is not installed, rule pre-filter uses the keyword lexicon only")
+        return None
+    return SentenceTransformer(EMBEDDING_MODEL_NAME)
+
+
+def _max_similarity(rule_text: str, sentences: list) -> float:
+    """Return the highest cosine similarity between the rule text and any transcript sentence."""
+    model = _get_embedding_model()
+    if model is None or not sentences:
+        return None
+    embeddings = model.encode([rule_text] + sentences, normalize_embeddings=True)
+    return float((embeddings[1:] @ embeddings[0]).max())
+
+
+def check_rule_applicability(rule: dict, sales_deck: str, sentences: list = None) -> dict:
+    """Decide whether a rule can apply to the sales deck.
+
+    Returns a dict with `applicable`, the `confidence` of a not-applicable verdict
+    (0 when applicable), the `keyword_hits`, the embedding `similarity` and a
+    human-readable `reason`, so skipped rules remain auditable.
+    """
+    terms = RULE_LEXICONS.get(rule['rule_name'])
+    if not terms:
+        return {'rule_name': rule['rule_name'], 'applicable': True, 'confidence': 0.0,
+                'keyword_hits': [], 'similarity': None, 'reason': "general rule, always checked"}
+
+    keyword_hits = sorted({match.lower() for match in _lexicon_pattern(terms).findall(sales_deck)})
+    if keyword_hits:
+        return {'rule_name': rule['rule_name'], 'applicable': True, 'confidence': 0.0,
+                'keyword_hits': keyword_hits, 'similarity': None,
+                'reason': f"mentions {', '.join(keyword_hits[:5])}"}
+
+    if sentences is None:
+        sentences = [sentence for sentence in re.split(r"(?<=[.!?])\s+", sales_deck) if sentence.strip()]
+    similarity = _max_similarity(rule['rule_text'], sentences)
+    if similarity is not None and similarity >= SIMILARITY_THRESHOLD:
+        return {'rule_name': rule['rule_name'], 'applicable': True, 'confidence': 0.0,
+                'keyword_hits': [], 'similarity': round(similarity, 3),
+                'reason': f"semantically close to the rule (similarity {similarity:.2f})"}
+
+    # Without embeddings only the lexicon spoke, so the verdict is less certain
+    confidence = 0.6 if similarity is None else 1.0 - max(similarity, 0.0) / SIMILARITY_THRESHOLD * 0.5
+    return {'rule_name': rule['rule_name'], 'applicable': False, 'confidence': round(confidence, 2),
+            'keyword_hits': [], 'similarity': None if similarity is None else round(similarity, 3),
+            'reason': "no product terms or related content found"}
+
+
+def prefilter_rules(rules_list: list, sales_deck: str, min_confidence: float = MIN_SKIP_CONFIDENCE) -> tuple[list, list]:
+    """Split the rules into (applicable_rules, skipped) where `skipped` holds the verdicts of the skipped rules.
+
+    Only rules judged not applicable with at least `min_confidence` are skipped.
+    """
+    sentences = [sentence for sentence in re.split(r"(?<=[.!?])\s+", sales_deck) if sentence.strip()]
+    applicable_rules, skipped = [], []
+    for rule in rules_list:
+        verdict = check_rule_applicability(rule, sales_deck, sentences)
+        if verdict['applicable']:
+            applicable_rules.append(rule)
+        elif verdict['confidence'] < min_confidence:
+            applicable_rules.append(rule)
+            logger.info(f"Checking rule '{rule['rule_name']}' anyway, skip confidence {verdict['confidence']} is too low")
+        else:
+            skipped.append(verdict)
+            logger.info(f"Skipping rule '{rule['rule_name']}' (confidence {verdict['confidence']}): {verdict['reason']}")
+    return applicable_rules, skipped
@@ -0,0 +1,137 @@
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+
+import faiss
+import numpy as np
+from langchain_core.documents import Document
+
+from pdf_parsing import RAG_TOP_K, get_embeddings, process_pdf, split_text
+
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+VECTOR_STORE_DIR = os.getenv("BERRYPIE_VECTOR_STORE_DIR", os.path.join("cache", "vectors"))
+# Per-PDF indexes kept open in memory; the rest are reopened (memory-mapped) on demand
+MAX_OPEN_INDEXES = 64
+
+
+class DocumentIndexStore:
+    """On-disk FAISS indexes, one per PDF, keyed by the SHA-256 of the file.
+
+    Each PDF is chunked and embedded once; its directory holds `index.faiss` and
+    the chunk texts in `chunks.json`. Saved indexes are memory-mapped when loaded,
+    so opening a large fact sheet does not copy its vectors into memory.
+    """
+
+    def __init__(self, root: str = VECTOR_STORE_DIR, max_open: int = MAX_OPEN_INDEXES):
+        self.root = root
+        self.max_open = max_open
+        self._lock = threading.Lock()
+        self._open = OrderedDict()
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, digest: str) -> str:
+        return os.path.join(self.root, digest)
+
+    def has(self, digest: str) -> bool:
+        return os.path.exists(os.path.join(self._path(digest), "chunks.json"))
+
+    def build(self, digest: str, text: str) -> bool:
+        """Chunk, embed and save the text of one PDF; returns False if it has no text."""
+        chunks = split_text(text) if text else []
+        if not chunks:
+            logger.warning(f"No text to index for {digest[:12]}")
+            return False
+        vectors = np.asarray(get_embeddings().embed_documents(chunks), dtype="float32")
+        index = faiss.IndexFlatL2(vectors.shape[1])
+        index.add(vectors)
+
+        # Written to a temporary directory and renamed, so a crash never leaves a half-written index
+        staging = tempfile.mkdtemp(dir=self.root, prefix=".staging-")
+        faiss.write_index(index, os.path.join(staging, "index.faiss"))
+        with open(os.path.join(staging, "chunks.json"), "w", encoding="utf-8") as f:
+            json.dump(chunks, f)
+        try:
+            os.rename(staging, self._path(digest))
+        except OSError:
+            # Another session indexed the same PDF first
+            shutil.rmtree(staging, ignore_errors=True)
+        logger.info(f"Indexed {len(chunks)} chunk(s) for {digest[:12]}")
+        return True
+
+    def load(self, digest: str) -> tuple:
+        """Return (index, chunks) for a stored PDF, memory-mapping the index on first use."""
+        with self._lock:
+            if digest in self._open:
+                self._open.move_to_end(digest)
+                return self._open[digest]
+
+        path = self._path(digest)
+        index_path = os.path.join(path, "index.faiss")
+        try:
+            index = faiss.read_index(index_path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+        except RuntimeError:
+            # Older faiss builds only memory-map some index types
+            index = faiss.read_index(index_path)
+        with open(os.path.join(path, "chunks.json"), encoding="utf-8") as f:
+            chunks = json.load(f)
+
+        with self._lock:
+            self._open[digest] = (index, chunks)
+            while len(self._open) > self.max_open:
+                self._open.popitem(last=False)
+        return index, chunks
+
+
+class DocumentRetriever:
+    """Long-lived retriever over a growing set of PDFs, backed by their per-PDF indexes.
+
+    `add_documents` only embeds PDFs the store has never seen; searching embeds the
+    query once and merges the nearest chunks of every PDF in the set.
+    """
+
+    def __init__(self, store: DocumentIndexStore = None):
+        self.store = store or get_index_store()
+        self.digests = []
+
+    def add_documents(self, documents: list):
+        """Add (sha256, path) pairs to the set, parsing and embedding only PDFs without a stored index."""
+        for digest, path in documents:
+            if digest in self.digests:
+                continue
+            if not self.store.has(digest) and not self.store.build(digest, process_pdf([path])):
+                continue
+            self.digests.append(digest)
+
+    def similarity_search(self, query: str, k: int = RAG_TOP_K) -> list:
+        """Return the k chunks closest to the query across all PDFs, as langchain Documents."""
+        if not self.digests:
+            return []
+        query_vector = np.asarray([get_embeddings().embed_query(query)], dtype="float32")
+        hits = []
+        for digest in self.digests:
+            index, chunks = self.store.load(digest)
+            distances, ids = index.search(query_vector, min(k, index.ntotal))
+            hits.extend(
+                (float(distance), digest, int(chunk_id), chunks[chunk_id])
+                for distance, chunk_id in zip(distances[0], ids[0]) if chunk_id >= 0
+            )
+        hits.sort(key=lambda hit: hit[0])
+        return [
+            Document(page_content=chunk, metadata={'sha256': digest, 'chunk': chunk_id, 'distance': distance})
+            for distance, digest, chunk_id, chunk in hits[:k]
+        ]
+
+
+@lru_cache(maxsize=None)
+def get_index_store() -> DocumentIndexStore:
+    """Return the process-wide document index store."""
+    return DocumentIndexStore()
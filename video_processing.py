@@ -1,32 +1,43 @@
-import streamlit as st
-import moviepy.editor as mp
 import os
 
 import cv2
+from pydub import AudioSegment
+from pydub.silence import detect_silence
 import base64
+import heapq
+import io
+import itertools
 import json
 import logging
-from groq import Groq
-from dotenv import load_dotenv
+import re
+import shutil
+import subprocess
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from groq_client import create_transcription
+from llm_cache import cached_chat_completion
+from result_cache import file_sha256, get_result_cache
 
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-# Load environment variables from a .env file
-GROQ_API_KEY = st.secrets["GROQ_API_KEY"]
-
-# load_dotenv()
-# GROQ_API_KEY = os.getenv('GROQ_API_KEY')
-
-# Initialize the Groq client
-client = Groq(api_key=GROQ_API_KEY)
+VISION_MODEL = "llama-3.2-90b-vision-preview"
+DISCLAIMER_MODEL = "llama-3.3-70b-versatile"
+# Bump when frame sampling or extraction defaults change, so cached frame texts are recomputed
+FRAME_PIPELINE_VERSION = "interval=5;dedup=5+text;crop=0"
+# Finer step probed for scene changes between the regular samples, to catch short-lived captions; 0 disables it
+SCENE_PROBE_SECONDS = float(os.getenv("BERRYPIE_SCENE_PROBE_SECONDS", 1))
 
 
 def extract_audio_from_video(video_path, output_audio_path):
     """Extracts audio from the video file and saves it as MP3."""
     try:
         logging.info(f"Starting audio extraction from video: {video_path}")
+        # moviepy is only the fallback of extract_speech_audio, so its slow import is paid only when needed
+        import moviepy.editor as mp
         # Load the video file
         video = mp.VideoFileClip(video_path)
         
@@ -44,18 +55,114 @@ def extract_audio_from_video(video_path, output_audio_path):
         return None
 
 
-def transcribe_audio_with_whisper(audio_path):
-    """Transcribes the audio using the specified Whisper model."""
+# Speech codecs accepted by Whisper: codec name -> (ffmpeg encoder, container, file extension)
+SPEECH_AUDIO_CODECS = {
+    "flac": ("flac", "flac", ".flac"),
+    "opus": ("libopus", "ogg", ".ogg"),
+}
+
+
+def get_ffmpeg_binary():
+    """Return the ffmpeg executable, preferring the one on PATH over the copy bundled with moviepy."""
+    binary = shutil.which("ffmpeg")
+    if binary:
+        return binary
+    import imageio_ffmpeg
+    return imageio_ffmpeg.get_ffmpeg_exe()
+
+
+def has_audio_stream(video_path):
+    """Return whether the video has an audio track, or None if ffmpeg could not read it."""
     try:
-        logging.info(f"Starting transcription for audio: {audio_path}")
-        with open(audio_path, "rb") as audio_file:
-            transcription = client.audio.transcriptions.create(
-                file=(audio_path, audio_file.read()),
-                model="whisper-large-v3-turbo", #whisper-large-v3, whisper-large-v3-turbo, distil-whisper-large-v3-en
-                prompt="Provide accurate transcription with context, correct spelling, and punctuation.",
-                response_format="json",
-                temperature=0.0
-            )
+        # Without an output ffmpeg only prints the input streams (and exits with an error)
+        probe = subprocess.run(
+            [get_ffmpeg_binary(), "-hide_banner", "-nostdin", "-i", video_path],
+            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, timeout=60,
+        )
+    except Exception as e:
+        logging.error(f"Error probing the streams of {video_path}: {e}")
+        return None
+    streams = [line for line in probe.stderr.decode(errors="replace").splitlines() if "Stream #" in line]
+    if not streams:
+        return None
+    return any(": Audio:" in line for line in streams)
+
+
+def extract_speech_audio(video_path, output_audio_path=None, codec="flac", chunk_size=1 << 16):
+    """Demux the audio track straight to 16 kHz mono speech audio through an ffmpeg pipe.
+
+    The encoded stream is written to `output_audio_path` as it arrives, or returned
+    as bytes when no path is given so nothing touches the disk. Returns None on failure.
+    """
+    try:
+        encoder, container, _ = SPEECH_AUDIO_CODECS[codec]
+        command = [
+            get_ffmpeg_binary(), "-nostdin", "-loglevel", "error",
+            "-i", video_path,
+            "-vn", "-ac", "1", "-ar", "16000", "-c:a", encoder,
+        ]
+        if codec == "opus":
+            command += ["-b:a", "24k", "-application", "voip"]
+        command += ["-f", container, "pipe:1"]
+
+        logging.info(f"Starting {codec} audio extraction from video: {video_path}")
+        sink = open(output_audio_path, "wb") if output_audio_path else io.BytesIO()
+        # stderr goes to a temporary file, not a pipe: a pipe nobody drains while stdout is
+        # read fills up on a damaged input and blocks ffmpeg and this process for good
+        with sink, tempfile.TemporaryFile() as stderr_file, \
+                subprocess.Popen(command, stdout=subprocess.PIPE, stderr=stderr_file) as process:
+            for chunk in iter(lambda: process.stdout.read(chunk_size), b""):
+                sink.write(chunk)
+            return_code = process.wait()
+            stderr_file.seek(0)
+            error_output = stderr_file.read().decode(errors="replace")
+            if return_code != 0:
+                logging.error(f"ffmpeg audio extraction failed: {error_output.strip()[-2000:]}")
+                return None
+            audio = output_audio_path or sink.getvalue()
+
+        logging.info("Audio extraction successful.")
+        return audio
+
+    except Exception as e:
+        logging.error(f"Error extracting audio from video: {e}")
+        return None
+
+
+WHISPER_MODEL = "whisper-large-v3-turbo" #whisper-large-v3, whisper-large-v3-turbo, distil-whisper-large-v3-en
+WHISPER_PROMPT = "Provide accurate transcription with context, correct spelling, and punctuation."
+# Uploads above this size are rejected by the API, so they are transcribed in chunks
+WHISPER_MAX_UPLOAD_BYTES = 24 * 1024 * 1024
+
+
+def transcribe_audio_with_whisper(audio, filename=None):
+    """Transcribes the audio using the specified Whisper model.
+
+    `audio` is either a file path or the encoded audio bytes, in which case
+    `filename` tells the API which format they are in. Audio too large for a
+    single request is transcribed with `transcribe_audio_chunked`.
+    """
+    try:
+        if isinstance(audio, (bytes, bytearray)):
+            filename = filename or "audio.flac"
+            audio_bytes = audio
+        else:
+            filename = filename or audio
+            with open(audio, "rb") as audio_file:
+                audio_bytes = audio_file.read()
+
+        if len(audio_bytes) > WHISPER_MAX_UPLOAD_BYTES:
+            logging.info(f"Audio is {len(audio_bytes) / 1024 / 1024:.1f} MB, switching to chunked transcription")
+            return transcribe_audio_chunked(audio_bytes, filename=filename)
+
+        logging.info(f"Starting transcription for audio: {filename}")
+        transcription = create_transcription(
+            file=(filename, audio_bytes),
+            model=WHISPER_MODEL,
+            prompt=WHISPER_PROMPT,
+            response_format="json",
+            temperature=0.0
+        )
         logging.info("Transcription completed successfully.")
         return transcription.text
     
@@ -64,6 +171,116 @@ def transcribe_audio_with_whisper(audio_path):
         return None
 
 
+def plan_audio_chunks(audio_segment, chunk_ms, search_ms=15_000, min_silence_ms=400):
+    """Return (start_ms, end_ms, cut_on_silence) chunks of at most `chunk_ms`.
+
+    Each cut is moved back to the middle of the last silence found in the
+    `search_ms` before the target boundary; `cut_on_silence` tells whether the
+    chunk starts on such a silence rather than on a hard cut.
+    """
+    chunks = []
+    silence_thresh = audio_segment.dBFS - 16
+    start_ms, cut_on_silence = 0, True
+    while start_ms < len(audio_segment):
+        end_ms = start_ms + chunk_ms
+        next_cut_on_silence = False
+        if end_ms < len(audio_segment):
+            window_start = max(start_ms, end_ms - search_ms)
+            silences = detect_silence(
+                audio_segment[window_start:end_ms], min_silence_len=min_silence_ms,
+                silence_thresh=silence_thresh, seek_step=10,
+            )
+            if silences:
+                silence_start, silence_end = silences[-1]
+                end_ms = window_start + (silence_start + silence_end) // 2
+                next_cut_on_silence = True
+        else:
+            end_ms = len(audio_segment)
+        chunks.append((start_ms, end_ms, cut_on_silence))
+        start_ms, cut_on_silence = end_ms, next_cut_on_silence
+    return chunks
+
+
+def _transcription_segments(transcription):
+    """Return the timestamped segments of a verbose_json transcription as dicts."""
+    segments = getattr(transcription, "segments", None)
+    if segments is None and getattr(transcription, "model_extra", None):
+        segments = transcription.model_extra.get("segments")
+    return [segment if isinstance(segment, dict) else dict(segment) for segment in segments or []]
+
+
+def transcribe_audio_chunk(audio_segment, start_ms, end_ms, overlap_ms):
+    """Transcribe one chunk and return its segments with timestamps relative to the full audio."""
+    chunk_start_ms = max(0, start_ms - overlap_ms)
+    buffer = io.BytesIO()
+    audio_segment[chunk_start_ms:end_ms].set_channels(1).set_frame_rate(16000).export(buffer, format="flac")
+
+    transcription = create_transcription(
+        file=(f"chunk_{start_ms}.flac", buffer.getvalue()),
+        model=WHISPER_MODEL,
+        prompt=WHISPER_PROMPT,
+        response_format="verbose_json",
+        temperature=0.0
+    )
+    segments = _transcription_segments(transcription)
+    if not segments:
+        # No timestamps returned, treat the chunk as a single segment
+        return [{"start": start_ms / 1000, "end": end_ms / 1000, "text": transcription.text}]
+
+    offset_seconds = chunk_start_ms / 1000
+    return [
+        {
+            "start": segment["start"] + offset_seconds,
+            "end": segment["end"] + offset_seconds,
+            "text": segment["text"].strip(),
+        }
+        for segment in segments
+    ]
+
+
+def transcribe_audio_chunked(audio, filename=None, chunk_seconds=600, overlap_seconds=2, max_workers=4,
+                             return_segments=False):
+    """Transcribe long audio as silence-aligned chunks sent to Whisper concurrently.
+
+    Chunks that start on a hard cut are extended `overlap_seconds` backwards so
+    no word is lost; when stitching, each segment is kept only by the chunk whose
+    own range contains its midpoint, which drops the words heard twice.
+    Returns the stitched text, or (text, segments) when `return_segments` is True.
+    """
+    try:
+        source = io.BytesIO(audio) if isinstance(audio, (bytes, bytearray)) else audio
+        audio_format = os.path.splitext(filename or "")[1].lstrip(".") or None
+        audio_segment = AudioSegment.from_file(source, format=audio_format)
+
+        chunks = plan_audio_chunks(audio_segment, chunk_seconds * 1000)
+        logging.info(f"Transcribing {len(audio_segment) / 1000:.0f} seconds of audio in {len(chunks)} chunk(s)")
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [
+                executor.submit(
+                    transcribe_audio_chunk, audio_segment, start_ms, end_ms,
+                    0 if cut_on_silence else overlap_seconds * 1000,
+                )
+                for start_ms, end_ms, cut_on_silence in chunks
+            ]
+            chunk_segments = [future.result() for future in futures]
+
+        segments = []
+        for (start_ms, end_ms, _), transcribed in zip(chunks, chunk_segments):
+            for segment in transcribed:
+                midpoint_ms = (segment["start"] + segment["end"]) * 500
+                if start_ms <= midpoint_ms < end_ms or (end_ms == len(audio_segment) and midpoint_ms >= end_ms):
+                    segments.append(segment)
+
+        text = " ".join(segment["text"] for segment in segments if segment["text"])
+        logging.info("Chunked transcription completed successfully.")
+        return (text, segments) if return_segments else text
+
+    except Exception as e:
+        logging.error(f"Error during chunked transcription: {e}")
+        return (None, []) if return_segments else None
+
+
 def frame_to_base64(frame):
     """Convert a video frame (OpenCV image) to a base64-encoded string."""
     try:
@@ -78,7 +295,87 @@ def frame_to_base64(frame):
         return None
 
 
-def process_frame(base64_image):
+def detect_text_region(frame, margin=0.03):
+    """Return the (x, y, w, h) box enclosing likely text in the frame, or None if no text is found."""
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    # Text detection does not need full resolution, work on a reduced copy
+    scale = min(1.0, 960 / max(gray.shape))
+    if scale < 1.0:
+        gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+    # Edges of glyphs stand out in the morphological gradient; closing horizontally joins them into lines
+    gradient = cv2.morphologyEx(gray, cv2.MORPH_GRADIENT, cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3)))
+    _, binary = cv2.threshold(gradient, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)
+    connected = cv2.morphologyEx(binary, cv2.MORPH_CLOSE, cv2.getStructuringElement(cv2.MORPH_RECT, (9, 1)))
+    contours, _ = cv2.findContours(connected, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+    boxes = []
+    for contour in contours:
+        x, y, w, h = cv2.boundingRect(contour)
+        # Text lines are wider than tall and densely filled with edges
+        if w < 8 or h < 4 or w < h:
+            continue
+        if cv2.countNonZero(binary[y:y + h, x:x + w]) / float(w * h) < 0.35:
+            continue
+        boxes.append((x, y, x + w, y + h))
+
+    if not boxes:
+        return None
+
+    height, width = frame.shape[:2]
+    pad_x, pad_y = int(width * margin), int(height * margin)
+    x0 = max(0, int(min(box[0] for box in boxes) / scale) - pad_x)
+    y0 = max(0, int(min(box[1] for box in boxes) / scale) - pad_y)
+    x1 = min(width, int(max(box[2] for box in boxes) / scale) + pad_x)
+    y1 = min(height, int(max(box[3] for box in boxes) / scale) + pad_y)
+    return x0, y0, x1 - x0, y1 - y0
+
+
+def encode_frame(frame, max_side=1280, target_bytes=200_000, image_format="jpeg", crop_to_text=False):
+    """Encode a frame into the smallest payload that keeps its text readable.
+
+    The frame is downscaled so its longest side is at most `max_side` and encoded
+    with the highest quality that fits in `target_bytes`. Returns (base64_str,
+    mime_type, payload_bytes), or None on failure.
+
+    `crop_to_text` first crops to the detected text region. It is opt-in: detection
+    runs on a reduced copy and misses thin small print on high-resolution frames,
+    which is exactly the disclaimer text the review looks for.
+    """
+    try:
+        if crop_to_text:
+            region = detect_text_region(frame)
+            if region:
+                x, y, w, h = region
+                frame = frame[y:y + h, x:x + w]
+
+        scale = max_side / max(frame.shape[:2])
+        if scale < 1.0:
+            frame = cv2.resize(frame, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+        if image_format == "webp":
+            extension, quality_flag, mime_type = ".webp", cv2.IMWRITE_WEBP_QUALITY, "image/webp"
+        else:
+            extension, quality_flag, mime_type = ".jpg", cv2.IMWRITE_JPEG_QUALITY, "image/jpeg"
+
+        # Step the quality down until the payload fits the budget
+        for quality in (90, 80, 70, 60, 50):
+            success, buffer = cv2.imencode(extension, frame, [quality_flag, quality])
+            if not success:
+                logging.error("Frame encoding failed")
+                return None
+            if len(buffer) <= target_bytes:
+                break
+
+        base64_str = base64.b64encode(buffer).decode('utf-8')
+        return base64_str, mime_type, len(base64_str)
+
+    except Exception as e:
+        logging.error(f"Error encoding frame: {e}")
+        return None
+
+
+def process_frame(base64_image, mime_type="image/jpeg"):
     """Processes the base64 image by sending it to the Groq API for text extraction."""
     text_prompt = """
     Your task is to extract the text from the provided image, focusing on any small disclaimers or warnings written in small size.
@@ -93,10 +390,9 @@ def process_frame(base64_image):
     }
     """
 
-    client = Groq(api_key=GROQ_API_KEY)
     try:
         # Send the image for processing to the Groq API
-        chat_completion = client.chat.completions.create(
+        content, _ = cached_chat_completion(
             messages=[
                 {
                     "role": "user",
@@ -105,13 +401,13 @@ def process_frame(base64_image):
                         {
                             "type": "image_url",
                             "image_url": {
-                                "url": f"data:image/jpeg;base64,{base64_image}",
+                                "url": f"data:{mime_type};base64,{base64_image}",
                             },
                         },
                     ],
                 }
             ],
-            model="llama-3.2-90b-vision-preview",
+            model=VISION_MODEL,
             response_format={"type": "json_object"},
             temperature=0.1,
             max_tokens=500,
@@ -120,7 +416,7 @@ def process_frame(base64_image):
         )
         
         # Parse the result
-        result = json.loads(chat_completion.choices[0].message.content)
+        result = json.loads(content)
         return result["image_content"]
     
     except Exception as e:
@@ -128,50 +424,377 @@ def process_frame(base64_image):
         return None
 
 
-def extract_and_process_frames(video_path, interval_seconds=5):
-    """Extract frames from the video and process each frame for text extraction."""
-    # Open the video file
+def frame_hash(frame, hash_size=8):
+    """Compute a 64-bit perceptual difference hash (dHash) of a video frame."""
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    resized = cv2.resize(gray, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    diff = (resized[:, 1:] > resized[:, :-1]).flatten()
+    return sum(1 << i for i, bit in enumerate(diff) if bit)
+
+
+def hash_distance(hash_a, hash_b):
+    """Return the Hamming distance between two frame hashes."""
+    return bin(hash_a ^ hash_b).count("1")
+
+
+def text_signature(frame, grid=(8, 8), max_width=1280):
+    """Return the fraction of strong-edge pixels in each cell of a grid over the frame.
+
+    Text is dense in sharp edges, so a line of small print added to an otherwise
+    unchanged frame moves its cells' values even though the dHash barely changes.
+    """
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    if gray.shape[1] > max_width:
+        scale = max_width / gray.shape[1]
+        gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    gradient = cv2.morphologyEx(gray, cv2.MORPH_GRADIENT, cv2.getStructuringElement(cv2.MORPH_RECT, (3, 3)))
+    _, edges = cv2.threshold(gradient, 40, 1.0, cv2.THRESH_BINARY)
+    return cv2.resize(edges.astype("float32"), grid, interpolation=cv2.INTER_AREA)
+
+
+class FrameDeduplicator:
+    """Drops frames that look like the previous frame sent for text extraction.
+
+    A frame is a duplicate only if its dHash is within `threshold` bits of the last
+    kept frame and no cell of its text signature changed by more than `text_threshold`.
+    Only the previous kept frame is compared, so a frame returning after a cut is
+    read again rather than matched against an earlier, text-free version of it.
+    """
+
+    def __init__(self, threshold=5, text_threshold=0.02):
+        self.threshold = threshold
+        self.text_threshold = text_threshold
+        self.last_hash = None
+        self.last_signature = None
+        self.kept = 0
+        self.skipped = 0
+
+    def is_duplicate(self, frame):
+        """Return True if the frame matches the last kept frame, otherwise remember it and return False."""
+        current_hash = frame_hash(frame)
+        signature = text_signature(frame)
+        if (self.last_hash is not None
+                and hash_distance(current_hash, self.last_hash) <= self.threshold
+                and cv2.absdiff(signature, self.last_signature).max() <= self.text_threshold):
+            self.skipped += 1
+            return True
+        self.last_hash = current_hash
+        self.last_signature = signature
+        self.kept += 1
+        return False
+
+
+def frame_sample_times(interval_seconds, duration_ms=None):
+    """Yield the integer millisecond timestamps at which frames should be sampled."""
+    interval_ms = int(round(interval_seconds * 1000))
+    if interval_ms <= 0:
+        raise ValueError("interval_seconds must be positive")
+    timestamp_ms = 0
+    while duration_ms is None or timestamp_ms < duration_ms:
+        yield timestamp_ms
+        timestamp_ms += interval_ms
+
+
+def _decode_frames(video, fps, timestamps, use_seek):
+    """Yield (timestamp_ms, frame) for each timestamp, decoding only those frames."""
+    grabbed = 0  # number of frames grabbed so far when walking the stream
+    for timestamp_ms in timestamps:
+        if use_seek:
+            video.set(cv2.CAP_PROP_POS_MSEC, timestamp_ms)
+            success, frame = video.read()
+        else:
+            # Index of the frame displayed at this timestamp
+            target_index = int(timestamp_ms * fps // 1000)
+            success = True
+            while success and grabbed <= target_index:
+                success = video.grab()
+                grabbed += 1
+            if success:
+                success, frame = video.retrieve()
+
+        if not success:
+            break
+        yield timestamp_ms, frame
+
+
+def sample_frames(video_path, interval_seconds=5, scene_probe_seconds=None, scene_threshold=12,
+                  seek_threshold_seconds=2):
+    """Yield (timestamp_ms, frame) pairs, decoding only the frames that are sampled.
+
+    Sparse intervals seek straight to each timestamp with CAP_PROP_POS_MSEC; dense
+    intervals walk the stream with grab() and only retrieve() the sampled frames.
+    When `scene_probe_seconds` is set, the video is also probed at that finer step
+    and a probe frame is yielded whenever it differs from the last yielded frame by
+    more than `scene_threshold` hash bits. The probe grid follows the access mode
+    of the regular interval, so a sparse interval with a probe still only seeks.
+    """
     video = cv2.VideoCapture(video_path)
-    
-    # Get the frames per second (fps) of the video
-    fps = video.get(cv2.CAP_PROP_FPS)
-    frame_count = 0
-    success, frame = video.read()
+    try:
+        fps = video.get(cv2.CAP_PROP_FPS)
+        if not fps or fps <= 0:
+            logging.error(f"Could not read the frame rate of video: {video_path}")
+            return
 
-    # List to store all extracted texts
-    extracted_texts = []
+        frame_total = int(video.get(cv2.CAP_PROP_FRAME_COUNT))
+        duration_ms = frame_total * 1000 / fps if frame_total > 0 else None
+        interval_ms = int(round(interval_seconds * 1000))
 
-    while success:
-        # Calculate the current timestamp in seconds
-        current_time_sec = frame_count / fps
-        
-        # Extract frame every `interval_seconds`
-        if current_time_sec % interval_seconds == 0:
-            print(f"Processing frame at {int(current_time_sec)} seconds")
-            
-            # Convert the frame to base64
-            base64_image = frame_to_base64(frame)
-            
-            if base64_image:
-                # Process the base64 image to extract text
-                extracted_text = process_frame(base64_image)
-                if extracted_text:
-                    print(f"Text from frame: {extracted_text}")
-                    extracted_texts.append(extracted_text)  # Add the extracted text to the list
+        if scene_probe_seconds:
+            # Merge the regular grid with the probe grid, dropping shared timestamps
+            merged = heapq.merge(
+                frame_sample_times(interval_seconds, duration_ms),
+                frame_sample_times(scene_probe_seconds, duration_ms),
+            )
+            timestamps = (timestamp_ms for timestamp_ms, _ in itertools.groupby(merged))
+        else:
+            timestamps = frame_sample_times(interval_seconds, duration_ms)
+
+        last_hash = None
+        # Walking the stream with grab() decodes every frame, so only dense regular intervals do it
+        use_seek = interval_seconds >= seek_threshold_seconds
+        for timestamp_ms, frame in _decode_frames(video, fps, timestamps, use_seek):
+            if scene_probe_seconds and timestamp_ms % interval_ms != 0:
+                current_hash = frame_hash(frame)
+                if last_hash is not None and hash_distance(current_hash, last_hash) <= scene_threshold:
+                    continue
+                logging.info(f"Scene change detected at {timestamp_ms / 1000:.1f} seconds")
+                last_hash = current_hash
+            elif scene_probe_seconds:
+                last_hash = frame_hash(frame)
+            yield timestamp_ms, frame
+    finally:
+        # Release the video capture object
+        video.release()
+
+
+# Words that usually appear in on-screen disclaimers and risk warnings
+DISCLAIMER_PATTERN = re.compile(
+    r"\b(risk|capital at risk|may lose|past performance|not guaranteed|terms|conditions|t&cs?|apply|"
+    r"representative|apr|authorised|regulated|fca|eligibility|credit|warning)\b",
+    re.IGNORECASE,
+)
+
+
+class FrameExtractionError(RuntimeError):
+    """Raised when the text of a frame could not be read, as opposed to the frame holding no text."""
+
+
+class FrameTextExtractor:
+    """Base class for engines that read on-screen text from a video frame."""
+
+    name = "base"
+
+    def extract(self, frame):
+        """Return (extracted_text, payload_bytes) for a frame; text is None when nothing was read.
+
+        Raises FrameExtractionError when the frame could not be read at all.
+        """
+        raise NotImplementedError
+
+
+class GroqVisionExtractor(FrameTextExtractor):
+    """Sends the encoded frame to the Groq vision model."""
+
+    name = "groq"
+
+    def __init__(self, **encode_options):
+        self.encode_options = encode_options
+
+    def extract(self, frame):
+        encoded = encode_frame(frame, **self.encode_options)
+        if not encoded:
+            print("no base64_image")
+            raise FrameExtractionError("The frame could not be encoded")
+        base64_image, mime_type, payload_bytes = encoded
+        # Process the base64 image to extract text; None means the request failed
+        extracted_text = process_frame(base64_image, mime_type)
+        if extracted_text is None:
+            raise FrameExtractionError("The vision model request failed")
+        return extracted_text, payload_bytes
+
+
+class LocalOCRExtractor(FrameTextExtractor):
+    """Reads frame text on the CPU with Tesseract, without any network call.
+
+    Requires the `pytesseract` package and the `tesseract` binary on PATH
+    (e.g. `apt-get install tesseract-ocr`); both are checked when it is created.
+    """
+
+    name = "local"
+
+    def __init__(self, lang="eng", min_word_confidence=30, crop_to_text=False):
+        try:
+            import pytesseract
+        except ImportError as e:
+            raise ImportError("LocalOCRExtractor requires pytesseract: pip install pytesseract") from e
+        try:
+            pytesseract.get_tesseract_version()
+        except pytesseract.TesseractNotFoundError as e:
+            raise RuntimeError("LocalOCRExtractor requires the tesseract binary: apt-get install tesseract-ocr") from e
+        self.pytesseract = pytesseract
+        self.lang = lang
+        self.min_word_confidence = min_word_confidence
+        # Opt-in for the same reason as in encode_frame: the crop can cut off small print
+        self.crop_to_text = crop_to_text
+
+    def read(self, frame):
+        """Return (text, mean_confidence) of the words Tesseract reads in the frame."""
+        region = detect_text_region(frame) if self.crop_to_text else None
+        if region:
+            x, y, w, h = region
+            frame = frame[y:y + h, x:x + w]
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        # Tesseract reads small disclaimer fonts better when they are enlarged
+        if max(gray.shape) < 1600:
+            gray = cv2.resize(gray, None, fx=2, fy=2, interpolation=cv2.INTER_CUBIC)
+
+        data = self.pytesseract.image_to_data(gray, lang=self.lang, output_type=self.pytesseract.Output.DICT)
+        words, confidences = [], []
+        for word, confidence in zip(data["text"], data["conf"]):
+            confidence = float(confidence)
+            if word.strip() and confidence >= self.min_word_confidence:
+                words.append(word.strip())
+                confidences.append(confidence)
+
+        mean_confidence = sum(confidences) / len(confidences) if confidences else 0.0
+        return " ".join(words), mean_confidence
+
+    def extract(self, frame):
+        text, _ = self.read(frame)
+        return (text or None), 0
+
+
+class HybridExtractor(FrameTextExtractor):
+    """Runs local OCR first and escalates only uncertain or disclaimer-like frames to the vision model."""
+
+    name = "hybrid"
+
+    def __init__(self, local=None, remote=None, min_confidence=75, escalate_pattern=DISCLAIMER_PATTERN):
+        self.local = local or LocalOCRExtractor()
+        self.remote = remote or GroqVisionExtractor()
+        self.min_confidence = min_confidence
+        self.escalate_pattern = escalate_pattern
+        self.escalated = 0
+        self.local_only = 0
+        self._lock = threading.Lock()
+
+    def should_escalate(self, frame, text, confidence):
+        """Decide whether the local reading is good enough to keep."""
+        if not text:
+            # Local OCR read nothing, only escalate if the frame looks like it holds text
+            return detect_text_region(frame) is not None
+        if confidence < self.min_confidence:
+            return True
+        return bool(self.escalate_pattern.search(text))
+
+    def extract(self, frame):
+        text, confidence = self.local.read(frame)
+        escalate = self.should_escalate(frame, text, confidence)
+        with self._lock:
+            if escalate:
+                self.escalated += 1
             else:
-                print("no base64_image")
-            
-        # Read the next frame
-        success, frame = video.read()
-        frame_count += 1
+                self.local_only += 1
+        if escalate:
+            return self.remote.extract(frame)
+        return (text or None), 0
 
-    # Release the video capture object
-    video.release()
+
+def get_frame_text_extractor(name="groq"):
+    """Build a frame text extractor by name: 'groq', 'local' or 'hybrid'."""
+    extractors = {
+        "groq": GroqVisionExtractor,
+        "local": LocalOCRExtractor,
+        "hybrid": HybridExtractor,
+    }
+    if name not in extractors:
+        raise ValueError(f"Unknown frame text extractor: {name}")
+    return extractors[name]()
+
+
+def extract_and_process_frames(video_path, interval_seconds=5, scene_probe_seconds=None, dedup_threshold=5,
+                               max_workers=4, extractor=None, stop_event=None):
+    """Extract frames from the video and process each frame for text extraction.
+
+    Decoding runs on the calling thread while up to `max_workers` frames are sent
+    to the vision model concurrently; at most `2 * max_workers` decoded frames are
+    held in memory at once. Texts are returned in timestamp order.
+
+    Frames that match the previously processed frame (perceptual hash within
+    `dedup_threshold` bits and an unchanged text signature) are skipped before the
+    vision call; pass None to disable. Set `scene_probe_seconds` to also catch
+    captions shown between sampled frames (video_media_processing does so by default).
+
+    `extractor` is the FrameTextExtractor used to read each frame, the Groq vision
+    model by default. Raises FrameExtractionError if any frame could not be read,
+    so a partial result is never mistaken for a video without on-screen text.
+
+    Setting `stop_event` stops decoding, cancels the queued frames and raises
+    FrameExtractionError once the frames already sent have returned.
+    """
+    extractor = extractor or GroqVisionExtractor()
+    deduplicator = FrameDeduplicator(dedup_threshold) if dedup_threshold is not None else None
+    # Bounds the number of decoded frames queued for the workers
+    slots = threading.BoundedSemaphore(2 * max_workers)
+
+    def worker(frame):
+        try:
+            return extractor.extract(frame)
+        finally:
+            slots.release()
+
+    futures = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for timestamp_ms, frame in sample_frames(video_path, interval_seconds, scene_probe_seconds):
+            if stop_event is not None and stop_event.is_set():
+                executor.shutdown(wait=False, cancel_futures=True)
+                break
+            if deduplicator and deduplicator.is_duplicate(frame):
+                logging.info(f"Skipping duplicate frame at {timestamp_ms / 1000:.1f} seconds")
+                continue
+
+            print(f"Processing frame at {timestamp_ms / 1000:.1f} seconds")
+            slots.acquire()
+            futures.append((timestamp_ms, executor.submit(worker, frame)))
+
+    if stop_event is not None and stop_event.is_set():
+        raise FrameExtractionError("Frame text extraction was stopped")
+
+    if deduplicator:
+        logging.info(f"Frame deduplication kept {deduplicator.kept} frame(s), skipped {deduplicator.skipped}")
+
+    # List to store all extracted texts, in timestamp order
+    extracted_texts = []
+    total_bytes = 0
+    failed_frames = 0
+    for timestamp_ms, future in futures:
+        try:
+            extracted_text, payload_bytes = future.result()
+        except Exception as e:
+            logging.error(f"Text extraction failed for frame at {timestamp_ms / 1000:.1f} seconds: {e}")
+            failed_frames += 1
+            continue
+        total_bytes += payload_bytes
+        logging.info(f"Frame at {timestamp_ms / 1000:.1f} seconds sent {payload_bytes / 1024:.1f} KB")
+        if extracted_text:
+            print(f"Text from frame at {timestamp_ms / 1000:.1f} seconds: {extracted_text}")
+            extracted_texts.append(extracted_text)  # Add the extracted text to the list
+
+    logging.info(f"Sent {len(futures)} frame(s), {total_bytes / 1024:.1f} KB in total")
+    if failed_frames:
+        raise FrameExtractionError(f"Text extraction failed for {failed_frames} of {len(futures)} frame(s)")
+    if isinstance(extractor, HybridExtractor):
+        logging.info(f"Hybrid OCR kept {extractor.local_only} frame(s) local, escalated {extractor.escalated}")
 
     # Return the list of all extracted texts
     return extracted_texts
 
 
+def is_valid_disclaimer(result):
+    """A disclaimer verdict must carry both keys to be used or cached."""
+    return isinstance(result, dict) and 'disclaimer_is_exist' in result and 'disclaimer_text' in result
+
+
 def check_and_extract_disclaimer(extracted_texts):
     system_message = """
         You are tasked with reviewing a list of texts to identify any disclaimer or warning messages.
@@ -189,8 +812,10 @@ def check_and_extract_disclaimer(extracted_texts):
             "disclaimer_text": ""
         }
         """
+    # Stays None if the request fails, so the failure is never cached as a verdict
+    result = None
     try:
-        chat_completion = client.chat.completions.create(
+        content, _ = cached_chat_completion(
             messages=[
                 {
                     "role": "system",
@@ -201,24 +826,47 @@ def check_and_extract_disclaimer(extracted_texts):
                     "content": f"This is the list that contains the extracted text: {extracted_texts}",
                 }
             ],
-            model="llama-3.3-70b-versatile",
+            model=DISCLAIMER_MODEL,
             response_format={"type": "json_object"},
             temperature=0.1,
             max_tokens=500,
             stream=False,
             stop=None,
+            validate=is_valid_disclaimer,
         )
-        print(chat_completion.choices[0].message.content)
-        result = json.loads(chat_completion.choices[0].message.content)
+        print(content)
+        result = json.loads(content)
     except Exception as e:
         print(f"Error processing the list: {e}")
 
     return result
 
-@st.cache_resource
-def video_media_processing(video_path):
-    extracted_texts = extract_and_process_frames(video_path)
-    result = check_and_extract_disclaimer(extracted_texts)
+def video_media_processing(video_path, extractor_name="groq", stop_event=None, scene_probe_seconds=SCENE_PROBE_SECONDS):
+    """Extract the on-screen texts of the video and check them for a disclaimer.
+
+    `extractor_name` selects the frame text extractor: 'groq', 'local' or 'hybrid'.
+    `scene_probe_seconds` is the scene-change probe step, 0 or None to only sample
+    the regular interval. Setting `stop_event` abandons the frame extraction early.
+    """
+    # Frame texts and the disclaimer verdict are cached by the content hash of the video
+    result_cache = get_result_cache()
+    video_digest = file_sha256(video_path)
+    version = f"{FRAME_PIPELINE_VERSION};scene_probe={scene_probe_seconds or 0:g}"
+    if extractor_name != "groq":
+        version += f";extractor={extractor_name}"
+    extracted_texts = result_cache.cached(
+        "frame_texts", video_digest,
+        lambda: extract_and_process_frames(video_path, scene_probe_seconds=scene_probe_seconds or None,
+                                           extractor=get_frame_text_extractor(extractor_name),
+                                           stop_event=stop_event),
+        model=VISION_MODEL, version=version,
+    )
+    result = result_cache.cached(
+        "disclaimer", video_digest, lambda: check_and_extract_disclaimer(extracted_texts),
+        model=DISCLAIMER_MODEL, version=version, cacheable=is_valid_disclaimer,
+    )
+    if not is_valid_disclaimer(result):
+        raise RuntimeError(f"Disclaimer check failed: {result}")
     checker_flag = result['disclaimer_is_exist']
     disclaimer_text = result['disclaimer_text']
     print(f"---\n Disclaimer exist : {checker_flag},\n disclaimer text: {disclaimer_text}")
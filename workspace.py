@@ -0,0 +1,121 @@
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+import time
+import uuid
+
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+WORKSPACE_ROOT = os.getenv("BERRYPIE_WORKSPACE_ROOT", "workspaces")
+# Workspaces untouched for longer than this are removed by the janitor
+WORKSPACE_MAX_AGE_SECONDS = int(os.getenv("BERRYPIE_WORKSPACE_MAX_AGE_SECONDS", 6 * 60 * 60))
+# Total disk budget for all workspaces; the least recently used ones are removed above it
+WORKSPACE_MAX_BYTES = int(os.getenv("BERRYPIE_WORKSPACE_MAX_BYTES", 20 * 1024 ** 3))
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+
+WORKSPACE_SUBDIRS = ("video", "audio", "pdf")
+
+
+def create_workspace(root: str = WORKSPACE_ROOT) -> str:
+    """Create a unique workspace directory with video, audio and pdf subdirectories."""
+    path = os.path.join(root, uuid.uuid4().hex)
+    for subdir in WORKSPACE_SUBDIRS:
+        os.makedirs(os.path.join(path, subdir), exist_ok=True)
+    logger.info(f"Created workspace {path}")
+    return path
+
+
+def touch_workspace(path: str):
+    """Mark a workspace as in use so the janitor does not evict it."""
+    os.utime(path, None)
+
+
+def save_upload(uploaded_file, directory: str, chunk_size: int = UPLOAD_CHUNK_SIZE) -> tuple[str, str]:
+    """Stream an uploaded file to disk in fixed-size chunks and return (path, sha256).
+
+    The file is named after its SHA-256 (keeping the extension), so re-uploading a
+    file with the same name but new content never overwrites a file a job is reading.
+    """
+    digest = hashlib.sha256()
+    uploaded_file.seek(0)
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".upload-")
+    with os.fdopen(fd, "wb") as f:
+        for chunk in iter(lambda: uploaded_file.read(chunk_size), b""):
+            digest.update(chunk)
+            f.write(chunk)
+    uploaded_file.seek(0)
+
+    extension = os.path.splitext(os.path.basename(uploaded_file.name))[1].lower()
+    path = os.path.join(directory, digest.hexdigest() + extension)
+    if os.path.exists(path):
+        # Same content already saved, keep the existing file untouched
+        os.remove(temp_path)
+    else:
+        os.replace(temp_path, path)
+    return path, digest.hexdigest()
+
+
+def workspace_of(path: str, root: str = WORKSPACE_ROOT) -> str:
+    """Return the workspace directory that contains `path`, or None if it is outside the workspaces."""
+    relative = os.path.relpath(os.path.abspath(path), os.path.abspath(root))
+    if relative.startswith(os.pardir) or os.path.isabs(relative):
+        return None
+    return os.path.join(root, relative.split(os.sep)[0])
+
+
+def directory_size(path: str) -> int:
+    """Return the total size in bytes of the files under a directory."""
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, filename))
+            except OSError:
+                continue
+    return total
+
+
+def evict_workspaces(root: str = WORKSPACE_ROOT, max_age_seconds: int = WORKSPACE_MAX_AGE_SECONDS,
+                     max_bytes: int = WORKSPACE_MAX_BYTES, keep: tuple = ()) -> list[str]:
+    """Remove workspaces older than `max_age_seconds`, then the least recently used ones until under `max_bytes`.
+
+    Workspaces listed in `keep`, e.g. the current session's and those holding the
+    files of queued or running jobs, are never removed. Returns the removed paths.
+    """
+    if not os.path.isdir(root):
+        return []
+
+    keep = {os.path.abspath(path) for path in keep}
+    now = time.time()
+    workspaces = []
+    for name in os.listdir(root):
+        path = os.path.join(root, name)
+        if os.path.isdir(path) and os.path.abspath(path) not in keep:
+            workspaces.append((os.path.getmtime(path), path))
+    workspaces.sort()
+
+    removed = []
+    remaining = []
+    for mtime, path in workspaces:
+        if now - mtime > max_age_seconds:
+            shutil.rmtree(path, ignore_errors=True)
+            removed.append(path)
+        else:
+            remaining.append((path, directory_size(path)))
+
+    total = sum(size for _, size in remaining) + sum(directory_size(path) for path in keep if os.path.isdir(path))
+    for path, size in remaining:
+        if total <= max_bytes:
+            break
+        shutil.rmtree(path, ignore_errors=True)
+        removed.append(path)
+        total -= size
+
+    if removed:
+        logger.info(f"Evicted {len(removed)} workspace(s) from {root}")
+    return removed